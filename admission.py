@@ -0,0 +1,212 @@
+"""
+Admission control: shed load early with a Retry-After instead of queueing it.
+
+- per-API-key token buckets (429), checked with the key itself in check_api_key
+- a bound on concurrent uploads per web process, taken after the key is checked and
+  before the body is read (503)
+- a bound on the processing backlog across all workers (503)
+- a bound on concurrent searches per web process, with a short wait (503)
+
+Limits on the web side are per process; with gunicorn multiply by the worker count.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+
+import metrics
+from database import AsyncSessionLocal
+from jobs import ACTIVE_STATUSES
+from models import ProcessingJob
+
+logger = logging.getLogger("admission")
+
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))  # 0 disables
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "0")) or max(1, math.ceil(RATE_LIMIT_PER_SECOND * 2))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "8"))  # 0 disables
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "1000"))  # queued + running jobs; 0 disables
+BACKLOG_CHECK_SECONDS = float(os.getenv("BACKLOG_CHECK_SECONDS", "2"))
+QUEUE_RETRY_AFTER_SECONDS = int(os.getenv("QUEUE_RETRY_AFTER_SECONDS", "30"))
+
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))  # 0 disables
+SEARCH_QUEUE_SECONDS = float(os.getenv("SEARCH_QUEUE_SECONDS", "2"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "2"))
+
+
+def overloaded(reason: str, detail: str, retry_after: int = RETRY_AFTER_SECONDS) -> HTTPException:
+    metrics.ADMISSION_REJECTIONS.labels(reason).inc()
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(retry_after, 1))})
+
+
+class RateLimiter:
+    """Token buckets keyed by API key; the least recently used keys are dropped past max_keys."""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: int = RATE_LIMIT_BURST,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """Takes a token for key. Returns 0 if allowed, else the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def check(self, key: str) -> None:
+        """Raises 429 with Retry-After when key is over its rate."""
+        wait = self.acquire(key)
+        if wait > 0:
+            metrics.ADMISSION_REJECTIONS.labels("rate_limit").inc()
+            raise HTTPException(
+                status_code=429, detail="Rate limit exceeded", headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+
+class ConcurrencyLimiter:
+    """At most `limit` holders at once in this process; others wait up to wait_seconds, then get a 503."""
+
+    def __init__(self, name: str, limit: int, wait_seconds: float = 0.0):
+        self.name = name
+        self.limit = limit
+        self.wait_seconds = wait_seconds
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> None:
+        if self.limit <= 0:
+            return
+        if self.semaphore is None:
+            # created on first use so it belongs to the server's event loop
+            self.semaphore = asyncio.Semaphore(self.limit)
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.wait_seconds or 0.001)
+        except asyncio.TimeoutError:
+            raise overloaded(self.name, f"Too many concurrent {self.name} requests, retry later") from None
+
+    def release(self) -> None:
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class JobBacklog:
+    """Queued and running job count across all workers, read at most every BACKLOG_CHECK_SECONDS."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, check_seconds: float = BACKLOG_CHECK_SECONDS):
+        self.session_factory = session_factory
+        self.check_seconds = check_seconds
+        self.count = 0
+        self.checked_at = float("-inf")
+        self.lock: Optional[asyncio.Lock] = None
+
+    async def current(self) -> int:
+        if time.monotonic() - self.checked_at < self.check_seconds:
+            return self.count
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if time.monotonic() - self.checked_at >= self.check_seconds:
+                try:
+                    async with self.session_factory() as db:
+                        self.count = (await db.execute(
+                            select(func.count())
+                            .select_from(ProcessingJob)
+                            .where(ProcessingJob.status.in_(ACTIVE_STATUSES))
+                        )).scalar()
+                except Exception as e:
+                    # admit on the last known count rather than fail uploads on a monitoring query
+                    logger.warning(f"Could not read the processing backlog: {e}")
+                self.checked_at = time.monotonic()
+        return self.count
+
+    async def check(self) -> None:
+        """Raises 503 when MAX_QUEUED_JOBS jobs are already waiting or running."""
+        if MAX_QUEUED_JOBS <= 0:
+            return
+        backlog = await self.current()
+        if backlog >= MAX_QUEUED_JOBS:
+            logger.warning(f"Rejecting upload: {backlog} jobs in the processing backlog")
+            raise overloaded("backlog", "Processing queue is full, retry later", QUEUE_RETRY_AFTER_SECONDS)
+
+
+rate_limiter = RateLimiter()
+
+
+def check_api_key(provided_key: Optional[str]) -> None:
+    """Raises 401 unless provided_key is the API key, then 429 when it is over its rate."""
+    if not provided_key or provided_key != os.getenv("API_KEY", "12345"):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    rate_limiter.check(provided_key)
+
+
+upload_limiter = ConcurrencyLimiter("upload", MAX_CONCURRENT_UPLOADS)
+search_limiter = ConcurrencyLimiter("search", SEARCH_CONCURRENCY, SEARCH_QUEUE_SECONDS)
+backlog = JobBacklog()
+
+
+class UploadAdmissionMiddleware:
+    """
+    Admits an upload before its body is parsed and spooled to disk: checks the API
+    key and rate limit first, so anonymous clients can't take slots or trigger the
+    backlog query, then rejects it while the processing backlog is full, and holds
+    an upload slot until the response ends.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            connection = HTTPConnection(scope)
+            check_api_key(connection.headers.get("x-api-key") or connection.query_params.get("api_key"))
+            # verify_api_key skips the key and rate limit checks already made here
+            scope.setdefault("state", {})["api_key_checked"] = True
+            await backlog.check()
+            await upload_limiter.acquire()
+        except HTTPException as e:
+            rejected = JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+            await rejected(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            upload_limiter.release()
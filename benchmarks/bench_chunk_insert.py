@@ -0,0 +1,87 @@
+"""
+Page insert throughput for page_writer.write_page_rows (one row per page with its chunk offsets).
+
+    python benchmarks/bench_chunk_insert.py --pages 2000 --min-rows-per-sec 4000
+
+Uses DATABASE_URL if set (point it at a scratch database), otherwise a temporary
+SQLite file. Prints a JSON result and exits non-zero when throughput is below
+--min-rows-per-sec.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import hashlib
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+import migrations  # noqa: E402
+import page_writer  # noqa: E402
+from database import engine, SessionLocal  # noqa: E402
+from models import Blob, DocumentPage  # noqa: E402
+
+
+def run_chunk_insert(pages: int, page_chars: int, chunk_size: int, batch_size: int) -> dict:
+    """Inserts the pages of a synthetic blob, removes them again and returns the timing."""
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+    page = " ".join(words[i % len(words)] for i in range(page_chars // 6))[:page_chars]
+    pages_text = [page] * pages
+
+    db = SessionLocal()
+    sha256 = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    try:
+        db.add(Blob(sha256=sha256, size=0, ref_count=0, status="processing"))
+        db.commit()
+
+        started = time.perf_counter()
+        rows = page_writer.write_page_rows(
+            db,
+            page_writer.iter_page_rows(sha256, pages_text, chunk_size),
+            batch_size=batch_size,
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        db.query(DocumentPage).filter(DocumentPage.sha256 == sha256).delete(synchronize_session=False)
+        db.query(Blob).filter(Blob.sha256 == sha256).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+    return {
+        "rows": rows,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 4),
+        "rows_per_sec": round(rows / elapsed if elapsed else float("inf"), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--batch-size", type=int, default=page_writer.INSERT_BATCH_SIZE)
+    parser.add_argument("--min-rows-per-sec", type=float, default=4000)
+    args = parser.parse_args()
+
+    migrations.upgrade(engine)
+
+    timing = run_chunk_insert(args.pages, args.page_chars, args.chunk_size, args.batch_size)
+    result = {
+        "benchmark": "chunk_insert",
+        "dialect": engine.dialect.name,
+        **timing,
+        "min_rows_per_sec": args.min_rows_per_sec,
+        "passed": timing["rows_per_sec"] >= args.min_rows_per_sec,
+    }
+    print(json.dumps(result))
+    sys.exit(0 if result["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+End-to-end benchmark of the ingest and query paths, run against the app in-process.
+
+    python benchmarks/bench_suite.py --documents 10 --pages 50 --concurrency 8 --output run.json
+    python benchmarks/compare.py baseline.json run.json
+
+Uses DATABASE_URL if set (point it at a scratch database, e.g. a local Postgres),
+otherwise a temporary SQLite file. Measures, on a synthetic corpus from corpus.py:
+
+- extraction pages/sec (processing.extract_pages in the process pool)
+- page insert rows/sec (page_writer.write_page_rows)
+- upload latency and upload -> ready latency with an in-process worker
+- page-read and search throughput and p50/p95/p99 latency under --concurrency clients
+
+Results are one JSON document with run metadata and flat, comparable metric names.
+Set CACHE_BACKEND=none to measure reads without the response cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_scratch = tempfile.mkdtemp(prefix="bench-")
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{_scratch}/bench.db"
+os.environ.setdefault("STORAGE_FOLDER", os.path.join(_scratch, "storage"))
+os.environ.setdefault("MAX_FILE_SIZE", str(200 * 1024 * 1024))
+
+import httpx  # noqa: E402
+
+import cache  # noqa: E402
+import corpus  # noqa: E402
+import main as app_main  # noqa: E402
+import migrations  # noqa: E402
+import processing  # noqa: E402
+import worker  # noqa: E402
+from bench_chunk_insert import run_chunk_insert  # noqa: E402
+from database import engine  # noqa: E402
+
+
+def percentiles(samples: List[float], prefix: str) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 and mean of latencies in seconds, reported in ms."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        f"{prefix}.p50_ms": round(rank(50) * 1000, 2),
+        f"{prefix}.p95_ms": round(rank(95) * 1000, 2),
+        f"{prefix}.p99_ms": round(rank(99) * 1000, 2),
+        f"{prefix}.mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+async def run_load(
+    name: str,
+    requests: int,
+    concurrency: int,
+    make_request: Callable[[int], Awaitable[httpx.Response]],
+) -> Dict[str, float]:
+    """Runs `requests` calls from `concurrency` clients and reports throughput and latency."""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for n in counter:
+            started = time.perf_counter()
+            response = await make_request(n)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        f"{name}.requests_per_sec": round(requests / elapsed, 1),
+        f"{name}.errors": errors,
+        **percentiles(latencies, name),
+    }
+
+
+class WorkerThread(threading.Thread):
+    """Runs worker.Worker jobs with a short poll interval so ready latency isn't dominated by polling."""
+
+    def __init__(self, executor: ProcessPoolExecutor, poll_seconds: float):
+        super().__init__(daemon=True)
+        self.worker = worker.Worker(executor)
+        self.poll_seconds = poll_seconds
+
+    def run(self):
+        while not self.worker.stopping:
+            if not self.worker.run_once():
+                time.sleep(self.poll_seconds)
+
+
+def measure_extraction(paths: List[str], executor: ProcessPoolExecutor) -> Dict[str, float]:
+    processing.extract_pages(paths[0], executor)  # warm up the pool
+    pages = 0
+    started = time.perf_counter()
+    for path in paths:
+        pages += len(processing.extract_pages(path, executor))
+    elapsed = time.perf_counter() - started
+    return {"extraction.pages": pages, "extraction.pages_per_sec": round(pages / elapsed, 1)}
+
+
+async def measure_ingest(
+    client: httpx.AsyncClient, paths: List[str], concurrency: int, timeout: float
+) -> Tuple[Dict[str, float], List[dict]]:
+    upload_latencies, ready_latencies = [], []
+    documents = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ingest(path: str):
+        with open(path, "rb") as file:
+            data = file.read()
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/documents", files={"file": (os.path.basename(path), data, "application/pdf")}
+            )
+            response.raise_for_status()
+            upload_latencies.append(time.perf_counter() - started)
+        document = response.json()
+        while document["status"] == "processing":
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"{path} was not processed within {timeout}s")
+            await asyncio.sleep(0.02)
+            document = (await client.get(f"/documents/{document['id']}")).json()
+        if document["status"] != "ready":
+            raise RuntimeError(f"{path} ended as {document['status']}")
+        ready_latencies.append(time.perf_counter() - started)
+        documents.append(document)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ingest(path) for path in paths))
+    elapsed = time.perf_counter() - started
+    pages = sum(document["page_count"] for document in documents)
+    metrics = {
+        "ingest.documents": len(documents),
+        "ingest.pages_per_sec": round(pages / elapsed, 1),
+        **percentiles(upload_latencies, "ingest.upload"),
+        **percentiles(ready_latencies, "ingest.ready"),
+    }
+    return metrics, documents
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    migrations.upgrade(engine)
+    paths = corpus.generate_corpus(
+        args.corpus_dir or os.path.join(_scratch, "corpus"), args.documents, args.pages, args.page_chars, args.seed
+    )
+    metrics: Dict[str, float] = {}
+    rng = random.Random(args.seed)
+
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        metrics.update(measure_extraction(paths, executor))
+
+        timing = run_chunk_insert(args.pages * args.documents, args.page_chars, args.chunk_size, args.batch_size)
+        metrics["chunk_insert.rows"] = timing["rows"]
+        metrics["chunk_insert.rows_per_sec"] = timing["rows_per_sec"]
+
+        worker_thread = WorkerThread(executor, args.poll_seconds)
+        worker_thread.start()
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", params={"api_key": os.getenv("API_KEY", "12345")}
+        ) as client:
+            try:
+                ingest_metrics, documents = await measure_ingest(client, paths, args.concurrency, args.ready_timeout)
+            finally:
+                worker_thread.worker.stop()
+            metrics.update(ingest_metrics)
+
+            pages = [(document["id"], number) for document in documents for number in range(1, document["page_count"] + 1)]
+            reads = [rng.choice(pages) for _ in range(args.requests)]
+            metrics.update(await run_load(
+                "page_read",
+                args.requests,
+                args.concurrency,
+                lambda n: client.get(f"/documents/{reads[n][0]}/pages/{reads[n][1]}"),
+            ))
+
+            queries = [
+                " ".join(rng.sample(corpus.WORDS, rng.randint(1, 2))) for _ in range(args.search_queries)
+            ]
+            metrics.update(await run_load(
+                "search",
+                args.requests,
+                args.concurrency,
+                lambda n: client.get("/search", params={"q": queries[n % len(queries)], "limit": 10}),
+            ))
+
+            for document in documents:
+                await client.delete(f"/documents/{document['id']}")
+        worker_thread.join(timeout=args.ready_timeout)
+
+    return {
+        "benchmark": "suite",
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dialect": engine.dialect.name,
+            "cache_backend": type(cache.backend).__name__,
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "corpus_dir")},
+        },
+        "metrics": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=50, help="pages per document")
+    parser.add_argument("--page-chars", type=int, default=3000, help="text density: characters per page")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--corpus-dir", help="keep the generated PDFs here instead of a temp directory")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per read/search load phase")
+    parser.add_argument("--search-queries", type=int, default=50, help="distinct search queries")
+    parser.add_argument("--processes", type=int, default=worker.EXTRACT_PROCESSES)
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("CHUNK_SIZE", "800")))
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--poll-seconds", type=float, default=0.05)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--output", help="write the JSON result here as well as to stdout")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
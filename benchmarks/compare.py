@@ -0,0 +1,76 @@
+"""
+Compares two bench_suite.py results and flags regressions.
+
+    python benchmarks/compare.py baseline.json run.json --max-regression 10
+
+Metrics ending in _per_sec are better when higher, latencies (_ms) and errors
+when lower; anything else is shown for information. Exits non-zero when a metric
+regressed by more than --max-regression percent.
+"""
+import argparse
+import json
+import sys
+from typing import Optional, Tuple
+
+
+def direction(metric: str) -> Optional[int]:
+    """+1 when higher is better, -1 when lower is better, None when informational."""
+    if metric.endswith("_per_sec"):
+        return 1
+    if metric.endswith("_ms") or metric.endswith(".errors"):
+        return -1
+    return None
+
+
+def compare(baseline: dict, current: dict, max_regression: float) -> Tuple[list, list]:
+    rows, regressions = [], []
+    for metric, old in baseline["metrics"].items():
+        new = current["metrics"].get(metric)
+        if new is None:
+            continue
+        change = (new - old) / old * 100 if old else (0.0 if new == old else float("inf"))
+        better = direction(metric)
+        regressed = better is not None and -better * change > max_regression
+        rows.append((metric, old, new, change, regressed))
+        if regressed:
+            regressions.append(metric)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed slowdown in percent")
+    parser.add_argument("--json", action="store_true", help="print the comparison as JSON")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    if baseline["meta"]["params"] != current["meta"]["params"]:
+        print("warning: runs used different parameters", file=sys.stderr)
+    if baseline["meta"]["dialect"] != current["meta"]["dialect"]:
+        print("warning: runs used different databases", file=sys.stderr)
+
+    rows, regressions = compare(baseline, current, args.max_regression)
+    if args.json:
+        print(json.dumps({
+            "baseline": baseline["meta"]["git_revision"],
+            "current": current["meta"]["git_revision"],
+            "max_regression": args.max_regression,
+            "metrics": {metric: {"baseline": old, "current": new, "change_pct": round(change, 2)}
+                        for metric, old, new, change, _ in rows},
+            "regressions": regressions,
+        }, indent=2))
+    else:
+        width = max(len(row[0]) for row in rows) if rows else 0
+        for metric, old, new, change, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{metric:<{width}}  {old:>12}  {new:>12}  {change:+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
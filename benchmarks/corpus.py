@@ -0,0 +1,106 @@
+"""
+Synthetic PDF corpus for benchmarks. Deterministic for a given seed, so runs are comparable.
+
+    python benchmarks/corpus.py --out /tmp/corpus --documents 10 --pages 100 --page-chars 3000
+"""
+import argparse
+import os
+import random
+from typing import List
+
+WORDS = (
+    "invoice contract warranty liability payment schedule delivery shipment audit report "
+    "quarter revenue expense budget forecast policy clause section appendix signature party "
+    "agreement termination renewal notice compliance review summary analysis customer vendor "
+    "account balance ledger statement period total amount currency region market product"
+).split()
+
+LINE_CHARS = 90
+
+
+def page_text(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.1:
+            word += str(rng.randint(1, 9999))
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def _wrap(text: str) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > LINE_CHARS:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_pdf(pages_text: List[str]) -> bytes:
+    """A minimal uncompressed PDF with one Helvetica text block per page."""
+    count = len(pages_text)
+    font_ref = 3 + 2 * count
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(count))}] /Count {count} >>",
+    ]
+    for i, text in enumerate(pages_text):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_ref} 0 R >> >> >>"
+        )
+        lines = [
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*"
+            for line in _wrap(text)
+        ]
+        stream = "BT /F1 9 Tf 11 TL 36 756 Td\n" + "\n".join(lines) + "\nET"
+        objects.append(f"<< /Length {len(stream.encode())} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def generate_corpus(out_dir: str, documents: int, pages: int, page_chars: int, seed: int = 1) -> List[str]:
+    """Writes corpus-<n>.pdf files and returns their paths."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for n in range(documents):
+        path = os.path.join(out_dir, f"corpus-{seed}-{n}.pdf")
+        with open(path, "wb") as file:
+            file.write(make_pdf([page_text(rng, page_chars) for _ in range(pages)]))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for path in generate_corpus(args.out, args.documents, args.pages, args.page_chars, args.seed):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
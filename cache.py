@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request, Response
+
+logger = logging.getLogger("cache")
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory, redis, fakeredis, none
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class CacheBackend:
+    """Byte-value cache interface. Backends must be safe to share across requests."""
+
+    # whether every web worker and the processing worker see the same entries
+    shared = False
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    async def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        pass
+
+    async def delete(self, *keys: str) -> None:
+        pass
+
+    async def incr(self, key: str) -> int:
+        return 0
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU with per-entry TTL, bounded by entry count and total value bytes."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # counters live outside the LRU so eviction can never reset a generation
+        self._counters: dict = {}
+        self._lock = threading.Lock()
+
+    def _pop(self, key: str) -> None:
+        expires_at, value = self._entries.pop(key)
+        self.size -= len(value)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key]).encode()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    async def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._pop(key)
+
+    async def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCache(CacheBackend):
+    """Shared backend for all web workers. Takes any redis.asyncio-compatible client, e.g. fakeredis locally."""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = "doclib:", sync_client=None):
+        self.client = client
+        self.prefix = prefix
+        # a blocking client for code without an event loop (the processing worker)
+        self.sync_client = sync_client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self.client.set(self.prefix + key, value, ex=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(self.prefix + key)
+
+
+def build_backend(name: str = CACHE_BACKEND) -> CacheBackend:
+    if name == "none":
+        return NullCache()
+    if name == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            logger.warning("CACHE_BACKEND=redis but the redis package is not installed; using memory cache")
+            return MemoryCache()
+        import redis as sync_redis
+
+        return RedisCache(redis.from_url(CACHE_URL), sync_client=sync_redis.from_url(CACHE_URL))
+    if name == "fakeredis":
+        try:
+            from fakeredis import aioredis
+        except ImportError:
+            logger.warning("CACHE_BACKEND=fakeredis but fakeredis is not installed; using memory cache")
+            return MemoryCache()
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        return RedisCache(aioredis.FakeRedis(server=server), sync_client=fakeredis.FakeRedis(server=server))
+    return MemoryCache()
+
+
+backend: CacheBackend = build_backend()
+
+
+def page_key(sha256: str, page_number: int) -> str:
+    # page text belongs to the blob and never changes once it is ready, so an entry
+    # can't go stale; callers look up the document first, so a deleted one 404s
+    return f"page:{sha256}:{page_number}"
+
+
+async def search_key(q: str, limit: int, pages_version: int = 0) -> str:
+    """
+    pages_version (search.pages_version) moves whenever the worker stores pages, so a
+    cached result never hides them, even in a per-process cache the worker can't reach.
+    """
+    generation = await backend.get("search:generation") or b"0"
+    digest = hashlib.sha256(f"{limit}:{pages_version}:{q}".encode()).hexdigest()
+    return f"search:{generation.decode()}:{digest}"
+
+
+async def invalidate_search() -> None:
+    """Orphans every cached search result by moving to a new generation."""
+    await backend.incr("search:generation")
+
+
+def invalidate_search_sync() -> None:
+    """
+    invalidate_search for the processing worker, called when a blob becomes ready or
+    failed. Only a shared backend is visible to the web workers; per-process caches
+    rely on the pages_version in search_key.
+    """
+    if not isinstance(backend, RedisCache) or backend.sync_client is None:
+        return
+    try:
+        backend.sync_client.incr(backend.prefix + "search:generation")
+    except Exception as e:
+        # cached searches then catch up within SEARCH_CACHE_TTL_SECONDS
+        logger.warning(f"Could not invalidate cached searches: {e}")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def json_response(request: Request, body: bytes) -> Response:
+    """JSON response with a strong ETag, or 304 when the client already has this body."""
+    etag = make_etag(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
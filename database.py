@@ -1,6 +1,9 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
 
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
@@ -14,10 +17,73 @@ if "sslmode=" not in DATABASE_URL and ("render.com" in DATABASE_URL or "herokuap
     sep = "&" if "?" in DATABASE_URL else "?"
     DATABASE_URL = f"{DATABASE_URL}{sep}sslmode=require"
 
+# Per-process pool sizing; with gunicorn the total is workers * (pool_size + max_overflow).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+_url = make_url(DATABASE_URL)
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+
+
+def _pool_options() -> dict:
+    if IS_SQLITE:
+        return {}
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+    }
+
+
+def _sync_connect_args() -> dict:
+    if _url.get_backend_name() == "postgresql" and STATEMENT_TIMEOUT_MS > 0:
+        return {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+def _async_url_and_connect_args():
+    """Maps DATABASE_URL onto asyncpg / aiosqlite, translating libpq-only options."""
+    if IS_SQLITE:
+        return _url.set(drivername="sqlite+aiosqlite"), {}
+
+    query = dict(_url.query)
+    connect_args = {}
+    sslmode = query.pop("sslmode", None)
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = sslmode
+    if STATEMENT_TIMEOUT_MS > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}
+    return _url.set(drivername="postgresql+asyncpg", query=query), connect_args
+
+
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,  
+    pool_pre_ping=True,
+    connect_args=_sync_connect_args(),
+    **_pool_options(),
 )
 
+_async_url, _async_connect_args = _async_url_and_connect_args()
+async_engine = create_async_engine(
+    _async_url,
+    pool_pre_ping=True,
+    connect_args=_async_connect_args,
+    **_pool_options(),
+)
+
+def create_migration_engine():
+    """
+    An engine for migrations.py: no statement_timeout, since index builds, table
+    copies and waiting for the migration lock can all outlast DB_STATEMENT_TIMEOUT_MS.
+    """
+    connect_args = {"options": "-c statement_timeout=0"} if _url.get_backend_name() == "postgresql" else {}
+    return create_engine(DATABASE_URL, poolclass=NullPool, connect_args=connect_args)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
@@ -0,0 +1,129 @@
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import cache
+import storage
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(microsecond=0), usegmt=True)
+
+
+def parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """RFC 9110 precedence: If-None-Match wins; If-Modified-Since only counts without it."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return cache.etag_matches(if_none_match, etag)
+    since = parse_http_date(request.headers.get("if-modified-since"))
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def range_applies(request: Request, etag: str, last_modified: datetime) -> bool:
+    """A Range is honoured unless If-Range names a different version of the file."""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return if_range == http_date(last_modified)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single "bytes=" range into inclusive (start, end). Returns None for
+    headers we answer with the whole file (other units, multiple ranges, garbage)
+    and raises a 416 when the range lies outside the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if start < 0 or (last and end < start):
+                return None
+        else:
+            # suffix range: the last N bytes; "bytes=-0" selects nothing
+            suffix = int(last)
+            if suffix < 0:
+                return None
+            start, end = (max(size - suffix, 0) if suffix else size), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+async def blob_response(request: Request, sha256: str, filename: str) -> Response:
+    """
+    Serves a stored blob with validators and byte ranges. Blobs are content
+    addressed, so the SHA-256 is a strong ETag that never needs recomputing.
+    """
+    backend = storage.backend
+    stat = await run_in_threadpool(backend.stat, sha256)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag = f'"{sha256}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.last_modified),
+        "Cache-Control": "private, max-age=0, must-revalidate",
+        "Accept-Ranges": "bytes",
+    }
+    if not_modified(request, etag, stat.last_modified):
+        return Response(status_code=304, headers=headers)
+
+    path = backend.local_path(sha256)
+    if path is not None:
+        # FileResponse handles Range/If-Range itself and hands the file to the
+        # server via http.response.pathsend when the server supports it
+        return FileResponse(path=path, filename=filename, media_type="application/pdf", headers=headers)
+
+    # object stores: fetch only the requested bytes
+    headers["Content-Disposition"] = content_disposition(filename)
+    start, end, status_code = 0, stat.size - 1, 200
+    header = request.headers.get("range")
+    if header and range_applies(request, etag, stat.last_modified):
+        byte_range = parse_range(header, stat.size)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    if request.method == "HEAD" or stat.size == 0:
+        return Response(status_code=status_code, headers=headers, media_type="application/pdf")
+    return StreamingResponse(
+        iterate_in_threadpool(backend.iter_range(sha256, start, end)),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+    )
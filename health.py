@@ -0,0 +1,74 @@
+"""
+Liveness and readiness probes.
+
+Liveness only shows the process is serving requests and never touches the database.
+Readiness also needs the database to answer and the schema to be migrated; its result
+is cached for HEALTH_CACHE_SECONDS, so frequent probes cost at most one query per
+period per process.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select, text
+
+from database import AsyncSessionLocal
+from migrations import LATEST_VERSION, schema_migrations
+
+logger = logging.getLogger("health")
+
+CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "5"))
+DB_TIMEOUT_SECONDS = float(os.getenv("HEALTH_DB_TIMEOUT_SECONDS", "2"))
+
+
+class ReadinessCheck:
+    """Caches (db_connection, problem); problem is None when the process is ready."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, cache_seconds: float = CACHE_SECONDS):
+        self.session_factory = session_factory
+        self.cache_seconds = cache_seconds
+        self.result: Tuple[bool, Optional[str]] = (False, "not checked yet")
+        self.checked_at = float("-inf")
+        self.lock: Optional[asyncio.Lock] = None
+
+    def _fresh(self) -> bool:
+        return time.monotonic() - self.checked_at < self.cache_seconds
+
+    async def check(self) -> Tuple[bool, Optional[str]]:
+        if self._fresh():
+            return self.result
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            # concurrent probes wait for the one query already in flight
+            if not self._fresh():
+                self.result = await self._query()
+                self.checked_at = time.monotonic()
+        return self.result
+
+    async def _query(self) -> Tuple[bool, Optional[str]]:
+        try:
+            async with self.session_factory() as db:
+                try:
+                    version = (
+                        await asyncio.wait_for(
+                            db.execute(select(func.max(schema_migrations.c.version))), DB_TIMEOUT_SECONDS
+                        )
+                    ).scalar()
+                except Exception:
+                    # no schema_migrations table yet, or no database at all
+                    await db.rollback()
+                    await asyncio.wait_for(db.execute(text("SELECT 1")), DB_TIMEOUT_SECONDS)
+                    version = None
+        except Exception as e:
+            logger.warning(f"Readiness check failed: {e!r}")
+            return False, "database unavailable"
+        # a newer release may already have migrated past this one; that schema still serves it
+        if version is None or version < LATEST_VERSION:
+            return True, f"schema version {version}, expected {LATEST_VERSION}; run python migrations.py"
+        return True, None
+
+
+readiness = ReadinessCheck()
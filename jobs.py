@@ -0,0 +1,292 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import exists, func, insert, literal, select, text, update
+from sqlalchemy.orm import Session
+
+from models import Blob, Document, ProcessingJob
+
+logger = logging.getLogger("jobs")
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = int(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+# jobs extracting at once across all workers; 0 leaves it to the number of workers
+MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "0"))
+# pool crashes after which a job's PDF is taken to be what kills the extraction process
+MAX_POOL_CRASHES = int(os.getenv("JOB_MAX_POOL_CRASHES", "2"))
+
+CLAIM_LOCK_ID = 726_302
+RECOVERY_LOCK_ID = 726_303
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def set_blob_status(
+    db: Session,
+    sha256: str,
+    status: str,
+    page_count: Optional[int] = None,
+    pages_done: Optional[int] = None,
+) -> None:
+    """Sets the extraction status and progress on a blob and every document that references it. The caller commits."""
+    values = {"status": status}
+    if page_count is not None:
+        values["page_count"] = page_count
+    if pages_done is not None:
+        values["pages_done"] = pages_done
+    db.execute(update(Blob).where(Blob.sha256 == sha256).values(**values))
+    db.execute(update(Document).where(Document.sha256 == sha256).values(**values))
+
+
+def enqueue_job(db: Session, sha256: str) -> ProcessingJob:
+    """Adds a processing job for the blob. The caller commits."""
+    job = ProcessingJob(
+        sha256=sha256,
+        status="queued",
+        attempts=0,
+        max_attempts=MAX_ATTEMPTS,
+        available_at=datetime.utcnow(),
+    )
+    db.add(job)
+    return job
+
+
+def claim_job(db: Session, worker_id: str, max_running: int = MAX_RUNNING) -> Optional[ProcessingJob]:
+    """
+    Leases the oldest runnable job to worker_id, or returns None when the queue is empty
+    or max_running jobs are already running. Uses SKIP LOCKED where the database
+    supports it; the conditional UPDATE keeps the claim exclusive on databases that don't.
+    """
+    now = datetime.utcnow()
+    if max_running > 0:
+        if db.bind.dialect.name == "postgresql":
+            # serialises capped claims so two workers can't both take the last slot; released at commit
+            db.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": CLAIM_LOCK_ID})
+        running = db.query(func.count(ProcessingJob.id)).filter(ProcessingJob.status == "running").scalar()
+        if running >= max_running:
+            db.rollback()
+            return None
+
+    candidate = (
+        db.query(ProcessingJob.id)
+        .filter(ProcessingJob.status == "queued", ProcessingJob.available_at <= now)
+        .order_by(ProcessingJob.available_at, ProcessingJob.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if candidate is None:
+        db.rollback()
+        return None
+
+    claimed = db.execute(
+        update(ProcessingJob)
+        .where(ProcessingJob.id == candidate.id, ProcessingJob.status == "queued")
+        .values(
+            status="running",
+            attempts=ProcessingJob.attempts + 1,
+            locked_by=worker_id,
+            lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+            updated_at=now,
+        )
+    ).rowcount
+    db.commit()
+    if claimed != 1:
+        return None
+    return db.get(ProcessingJob, candidate.id)
+
+
+def renew_lease(db: Session, job_id: int, worker_id: str) -> bool:
+    """Extends a running job's lease. Returns False if the lease was lost to recovery."""
+    now = datetime.utcnow()
+    renewed = db.execute(
+        update(ProcessingJob)
+        .where(
+            ProcessingJob.id == job_id,
+            ProcessingJob.status == "running",
+            ProcessingJob.locked_by == worker_id,
+        )
+        .values(lease_expires_at=now + timedelta(seconds=LEASE_SECONDS), updated_at=now)
+    ).rowcount
+    db.commit()
+    return renewed == 1
+
+
+def complete_job(db: Session, job_id: int, worker_id: str) -> bool:
+    """Marks the job done if worker_id still holds its lease. Returns False if the lease was lost to recovery."""
+    completed = db.execute(
+        update(ProcessingJob)
+        .where(
+            ProcessingJob.id == job_id,
+            ProcessingJob.status == "running",
+            ProcessingJob.locked_by == worker_id,
+        )
+        .values(status="done", locked_by=None, lease_expires_at=None, updated_at=datetime.utcnow())
+    ).rowcount
+    db.commit()
+    return completed == 1
+
+
+def _leased_job(
+    db: Session, job_id: int, worker_id: Optional[str] = None, expired_before: Optional[datetime] = None
+) -> Optional[ProcessingJob]:
+    """
+    The running job, freshly read, if worker_id holds its lease or, with expired_before,
+    if its lease expired before then; otherwise None.
+    """
+    query = db.query(ProcessingJob).filter(ProcessingJob.id == job_id, ProcessingJob.status == "running")
+    if worker_id is not None:
+        query = query.filter(ProcessingJob.locked_by == worker_id)
+    if expired_before is not None:
+        query = query.filter(ProcessingJob.lease_expires_at < expired_before)
+    return query.populate_existing().first()
+
+
+def _release_lease(db: Session, job: ProcessingJob, **values) -> bool:
+    """
+    Ends the lease the job was read with and applies values. Conditional on that lease,
+    like renew_lease, so a job that was requeued and claimed again in the meantime is
+    left alone. Returns False, rolling back, if the lease had already changed.
+    """
+    released = db.execute(
+        update(ProcessingJob)
+        .where(
+            ProcessingJob.id == job.id,
+            ProcessingJob.status == "running",
+            ProcessingJob.attempts == job.attempts,
+            ProcessingJob.locked_by.is_not_distinct_from(job.locked_by),
+            ProcessingJob.lease_expires_at.is_not_distinct_from(job.lease_expires_at),
+        )
+        .values(locked_by=None, lease_expires_at=None, updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if released != 1:
+        db.rollback()
+    return released == 1
+
+
+def fail_job(
+    db: Session,
+    job_id: int,
+    error: str,
+    worker_id: Optional[str] = None,
+    expired_before: Optional[datetime] = None,
+) -> bool:
+    """
+    Requeues the running job with backoff, or marks it and its documents failed once
+    attempts run out. With worker_id, only while that worker holds the lease; with
+    expired_before, only while the lease is still expired. Returns True if it acted.
+    """
+    job = _leased_job(db, job_id, worker_id, expired_before)
+    if job is None:
+        db.rollback()
+        return False
+    error = error[:2000]
+    if job.attempts >= job.max_attempts:
+        if not _release_lease(db, job, status="failed", last_error=error):
+            return False
+        set_blob_status(db, job.sha256, "failed")
+        logger.error(f"Job {job.id} for blob {job.sha256} failed permanently: {error}")
+    else:
+        available_at = datetime.utcnow() + timedelta(seconds=RETRY_BACKOFF_SECONDS * job.attempts)
+        if not _release_lease(db, job, status="queued", last_error=error, available_at=available_at):
+            return False
+        logger.warning(f"Job {job.id} for blob {job.sha256} will retry: {error}")
+    db.commit()
+    return True
+
+
+def release_crashed_job(db: Session, job_id: int, worker_id: str, error: str) -> bool:
+    """
+    Handles a job whose extraction process pool died under it. The process may have
+    been killed from outside (e.g. the OOM killer), so the crash isn't counted as an
+    attempt and the job is requeued at once; only after MAX_POOL_CRASHES crashes is
+    its PDF blamed and the job failed. Returns True if it acted.
+    """
+    job = _leased_job(db, job_id, worker_id)
+    if job is None:
+        db.rollback()
+        return False
+    crashes = job.pool_crashes + 1
+    error = error[:2000]
+    if crashes >= MAX_POOL_CRASHES:
+        if not _release_lease(db, job, status="failed", pool_crashes=crashes, last_error=error):
+            return False
+        set_blob_status(db, job.sha256, "failed")
+        logger.error(f"Job {job.id} for blob {job.sha256} failed: it crashed the extraction process {crashes} times")
+    else:
+        if not _release_lease(
+            db,
+            job,
+            status="queued",
+            pool_crashes=crashes,
+            attempts=max(job.attempts - 1, 0),
+            available_at=datetime.utcnow(),
+            last_error=error,
+        ):
+            return False
+        logger.warning(f"Job {job.id} for blob {job.sha256} requeued after the extraction process crashed")
+    db.commit()
+    return True
+
+
+def _enqueue_orphan(db: Session, sha256: str) -> bool:
+    """
+    Enqueues a job for the blob unless it already has an active one, in a single
+    INSERT ... SELECT so the check and the insert can't be split by another worker.
+    """
+    now = datetime.utcnow()
+    active = exists().where(ProcessingJob.sha256 == sha256, ProcessingJob.status.in_(ACTIVE_STATUSES))
+    job = select(
+        Blob.sha256,
+        literal("queued"),
+        literal(0),
+        literal(MAX_ATTEMPTS),
+        literal(0),
+        literal(now),
+        literal(now),
+        literal(now),
+    ).where(Blob.sha256 == sha256, Blob.status == "processing", ~active)
+    columns = [
+        "sha256", "status", "attempts", "max_attempts", "pool_crashes", "available_at", "created_at", "updated_at"
+    ]
+    return db.execute(insert(ProcessingJob).from_select(columns, job)).rowcount == 1
+
+
+def recover_stale_jobs(db: Session) -> int:
+    """
+    Requeues running jobs whose lease expired (the worker died) and enqueues a job
+    for any blob left in status="processing" without one. Safe to run from several
+    workers at once: each expired lease is released once, and orphans are enqueued
+    under RECOVERY_LOCK_ID on PostgreSQL. Returns the number of jobs recovered or created.
+    """
+    now = datetime.utcnow()
+    expired = (
+        db.query(ProcessingJob.id)
+        .filter(ProcessingJob.status == "running", ProcessingJob.lease_expires_at < now)
+        .all()
+    )
+    recovered = sum(fail_job(db, job_id, "lease expired", expired_before=now) for (job_id,) in expired)
+
+    if db.bind.dialect.name == "postgresql":
+        # READ COMMITTED lets two concurrent INSERT ... SELECTs both miss the other's job; released at commit
+        db.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": RECOVERY_LOCK_ID})
+    orphaned = (
+        db.query(Blob.sha256)
+        .filter(
+            Blob.status == "processing",
+            ~exists().where(
+                ProcessingJob.sha256 == Blob.sha256,
+                ProcessingJob.status.in_(ACTIVE_STATUSES),
+            ),
+        )
+        .all()
+    )
+    for (sha256,) in orphaned:
+        if _enqueue_orphan(db, sha256):
+            logger.warning(f"Re-enqueueing orphaned blob: {sha256}")
+            recovered += 1
+    db.commit()
+    return recovered
@@ -1,30 +1,47 @@
 from datetime import datetime
 import logging
 import os
-import shutil
 import uuid
-from pathlib import Path
 from typing import Annotated, Optional, List
 
 import fastapi
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, BackgroundTasks, Query, Header
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, ConfigDict, Field
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Query, Header, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import admission
+import cache
+import downloads
+import health
+import jobs
+import metrics
+import pagination
+import progress
+import search
+import similarity
+import storage
+import uploads
 import utils
-import models
-from models import Document, DocumentPage
-from database import engine, SessionLocal
+from models import Blob, BlobBand, Document, DocumentPage, ProcessingJob
+from database import engine, async_engine, AsyncSessionLocal
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s")
+metrics.install_log_filter()
 logger = logging.getLogger("app")
 
-app = FastAPI()
-
+STREAM_YIELD_PER = int(os.getenv("STREAM_YIELD_PER", "500"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", str(64 * 1024)))
 
-models.Base.metadata.create_all(bind=engine)
+app = FastAPI()
+app.add_middleware(admission.UploadAdmissionMiddleware, paths=uploads.UPLOAD_PATHS)
+app.add_middleware(uploads.UploadLimitMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
 
 class DocumentResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -32,9 +49,21 @@ class DocumentResponse(BaseModel):
     filename: str
     size: int
     page_count: Optional[int] = None
+    pages_done: int = 0
     status: str
     created_at: datetime
 
+class DocumentListResponse(BaseModel):
+    documents: List[DocumentResponse]
+    next_cursor: Optional[str] = None
+    limit: int
+    total: Optional[int] = None
+
+class BatchUploadResult(BaseModel):
+    filename: Optional[str] = None
+    document: Optional[DocumentResponse] = None
+    error: Optional[str] = None
+
 class DocumentPageResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     page_number: int
@@ -45,130 +74,112 @@ class HealthResponse(BaseModel):
     status: str
     fastapi_version: str
     db_connection: bool
+    detail: Optional[str] = None
 
 class SearchResult(BaseModel):
     document_id: str
     filename: str
     page_number: int
     text_snippet: str
+    score: float
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class SimilarDocument(BaseModel):
+    document_id: str
+    filename: str
+    similarity: float
+    near_duplicate: bool
 
-db_dependency = Annotated[Session, Depends(get_db)]
+search_results_adapter = TypeAdapter(List[SearchResult])
 
-def verify_api_key(x_api_key: str = Header(None), api_key: str = Query(None)):
-    expected_key = os.getenv("API_KEY", "12345")
-    provided_key = x_api_key or api_key
-    if not provided_key or provided_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    return True
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
-def process_document_task(document_id: str, file_path: str):
-    db = None
-    try:
-        logger.info(f"Processing document: {document_id}")
-        db = SessionLocal()
-
-        document = db.query(Document).filter(Document.id == document_id).first()
-        if not document:
-            logger.error(f"Document not found: {document_id}")
-            return
-
-        pages_text = utils.extract_text_from_pdf(file_path)
-
-        if pages_text is None or len(pages_text) == 0:
-            document.status = "failed"
-            db.commit()
-            logger.error(f"Failed to extract text from: {document_id}")
-            return
-
-        chunk_size = int(os.getenv("CHUNK_SIZE", "800"))
-        for page_num, page_text in enumerate(pages_text, 1):
-            chunks = utils.split_text_into_chunks(page_text, chunk_size)
-            for chunk_index, chunk in enumerate(chunks):
-                page_record = DocumentPage(
-                    document_id=document_id,
-                    page_number=page_num,
-                    text=chunk,
-                    chunk_index=chunk_index,
-                )
-                db.add(page_record)
+def verify_api_key(request: Request, x_api_key: str = Header(None), api_key: str = Query(None)):
+    if not getattr(request.state, "api_key_checked", False):
+        admission.check_api_key(x_api_key or api_key)
+    return True
 
-        document.status = "ready"
-        db.commit()
-        logger.info(f"Document processed: {document_id}")
 
-    except Exception as e:
-        logger.error(f"Error processing document {document_id}: {e}")
-        try:
-            if db is None:
-                db = SessionLocal()
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if document:
-                document.status = "failed"
-                db.commit()
-        except Exception as inner:
-            logger.error(f"Failed to mark document failed: {inner}")
-    finally:
+async def attach_blob(db: AsyncSession, sha256: str, size: int) -> Blob:
+    """
+    Takes a reference on the blob for this content, creating it and queueing
+    extraction the first time it is seen. Known content keeps its status, so a
+    re-upload of a ready file is ready immediately.
+    """
+    # populate_existing: a batch upload reuses the session, and an earlier attach may have
+    # left this blob in it with values another session has since changed
+    blob = await db.get(Blob, sha256, with_for_update=True, populate_existing=True)
+    if blob is None:
         try:
-            if db:
-                db.close()
-        except Exception:
-            pass
-
-@app.post("/documents", response_model=DocumentResponse)
-async def upload_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    _api_key_valid: bool = Depends(verify_api_key),
-):
-    if not file.filename.lower().endswith(".pdf"):
+            async with db.begin_nested():
+                blob = Blob(sha256=sha256, size=size, ref_count=0, pages_done=0, status="processing")
+                db.add(blob)
+                jobs.enqueue_job(db, sha256)
+        except IntegrityError:
+            # a concurrent upload of the same content created it first
+            blob = await db.get(Blob, sha256, with_for_update=True, populate_existing=True)
+    elif blob.status == "failed":
+        blob.status = "processing"
+        jobs.enqueue_job(db, sha256)
+    blob.ref_count += 1
+    return blob
+
+async def ingest_upload(db: AsyncSession, file: UploadFile) -> Document:
+    """Stores one uploaded PDF and creates its Document. Raises HTTPException for bad files."""
+    if not (file.filename or "").lower().endswith(".pdf"):
         logger.warning(f"Invalid file type: {file.filename}")
         raise HTTPException(status_code=400, detail="Only PDF files allowed")
 
-    max_file_size = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+    max_file_size = uploads.get_max_file_size()
+    tmp_path = storage.temp_upload_path()
 
     try:
-        document_id = str(uuid.uuid4())
-        storage_filename = f"{document_id}.pdf"
+        saved_size, sha256 = await uploads.save_upload(file, tmp_path, max_file_size)
 
-        storage_root = os.getenv("STORAGE_FOLDER", str(Path.cwd() / "storage"))
-        os.makedirs(storage_root, exist_ok=True)
-        file_path = os.path.join(storage_root, storage_filename)
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        saved_size = os.path.getsize(file_path)
-        if saved_size > max_file_size:
-            os.remove(file_path)
-            logger.warning(f"File too large after save: {saved_size} bytes")
-            raise HTTPException(status_code=400, detail="File too large")
-
-        page_count = utils.get_page_count(file_path)
+        blob = await attach_blob(db, sha256, saved_size)
+        # known content is normally stored already; putting it again would only rewrite the
+        # object (and its Last-Modified), so the temp file is just dropped below
+        if blob.ref_count == 1 or not await run_in_threadpool(storage.blob_exists, sha256):
+            await run_in_threadpool(storage.store_blob, tmp_path, sha256)
 
         document = Document(
-            id=document_id,
+            id=str(uuid.uuid4()),
             filename=file.filename,
             size=saved_size,
-            page_count=page_count,
-            status="processing",
+            sha256=sha256,
+            page_count=blob.page_count,
+            pages_done=blob.pages_done,
+            status=blob.status,
         )
 
         db.add(document)
-        db.commit()
-        db.refresh(document)
+        await db.commit()
+        await db.refresh(document)
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if document.status == "ready":
+        # known content is searchable straight away
+        await cache.invalidate_search()
 
-        background_tasks.add_task(process_document_task, document_id, file_path)
+    logger.info(f"Document uploaded: {file.filename} ({document.id}, {document.status})")
+    return document
 
-        logger.info(f"Document uploaded: {file.filename} ({document_id})")
+@app.post("/documents", response_model=DocumentResponse)
+async def upload_document(
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    try:
+        document = await ingest_upload(db, file)
         return DocumentResponse.model_validate(document)
 
     except HTTPException:
@@ -177,79 +188,264 @@ async def upload_document(
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail="Upload failed")
 
-@app.get("/documents", response_model=list[DocumentResponse])
+@app.post("/documents/batch", response_model=list[BatchUploadResult])
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    if len(files) > uploads.get_max_batch_files():
+        raise HTTPException(status_code=400, detail=f"At most {uploads.get_max_batch_files()} files per batch")
+
+    results: list[BatchUploadResult] = []
+    for file in files:
+        try:
+            document = await ingest_upload(db, file)
+            results.append(BatchUploadResult(filename=file.filename, document=DocumentResponse.model_validate(document)))
+        except HTTPException as e:
+            results.append(BatchUploadResult(filename=file.filename, error=e.detail))
+        except Exception as e:
+            logger.error(f"Error uploading document {file.filename}: {e}")
+            results.append(BatchUploadResult(filename=file.filename, error="Upload failed"))
+    return results
+
+@app.get("/documents", response_model=DocumentListResponse)
 async def get_documents(
     limit: int = Query(10, ge=1, le=100),
-    offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    include_total: bool = Query(False),
+    db: AsyncSession = Depends(get_db),
 ):
-    documents = db.query(Document).offset(offset).limit(limit).all()
-    return [DocumentResponse.model_validate(doc) for doc in documents]
+    query = select(Document).order_by(Document.created_at.desc(), Document.id.desc())
+    if status:
+        query = query.where(Document.status == status)
+    if cursor:
+        created_at, document_id = pagination.decode_cursor(cursor)
+        query = query.where(tuple_(Document.created_at, Document.id) < tuple_(created_at, document_id))
+
+    # one extra row tells us whether there is a next page
+    documents = (await db.scalars(query.limit(limit + 1))).all()
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = pagination.encode_cursor(last.created_at, last.id)
+
+    return DocumentListResponse(
+        documents=[DocumentResponse.model_validate(doc) for doc in documents],
+        next_cursor=next_cursor,
+        limit=limit,
+        total=await pagination.estimate_document_total(db) if include_total else None,
+    )
 
 @app.get("/documents/{document_id}", response_model=DocumentResponse)
-async def get_document(document_id: str, db: Session = Depends(get_db)):
-    document = db.query(Document).filter(Document.id == document_id).first()
+async def get_document(document_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
-    return DocumentResponse.model_validate(document)
+    # not cached: an in-process cache can't see a delete served by another worker
+    body = DocumentResponse.model_validate(document).model_dump_json().encode()
+    return cache.json_response(request, body)
 
 @app.get("/documents/{document_id}/pages/{page_number}", response_model=DocumentPageResponse)
 async def get_document_page(
     document_id: str,
     page_number: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     _api_key_valid: bool = Depends(verify_api_key),
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    # the document is always read, so a deleted one 404s on every worker; only the page text is cached
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    sha256, ready = document.sha256, document.status == "ready"
+    # pages are readable as soon as they are extracted
+    processing = document.status == "processing" and page_number <= (document.page_count or page_number)
+
+    key = cache.page_key(sha256, page_number)
+    body = await cache.backend.get(key)
+    if body is None:
+        page = (
+            await db.execute(
+                select(DocumentPage.text, DocumentPage.chunk_offsets).where(
+                    DocumentPage.sha256 == sha256,
+                    DocumentPage.page_number == page_number,
+                )
+            )
+        ).first()
+
+        if page is None:
+            if processing:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Page not extracted yet",
+                    headers={"Retry-After": str(max(int(progress.POLL_SECONDS), 1))},
+                )
+            raise HTTPException(status_code=404, detail="Page not found")
 
-    page_chunks = (
-        db.query(DocumentPage)
-        .filter(
-            DocumentPage.document_id == document_id,
-            DocumentPage.page_number == page_number,
-        )
-        .order_by(DocumentPage.chunk_index)
-        .all()
-    )
-
-    if not page_chunks:
-        raise HTTPException(status_code=404, detail="Page not found")
+        body = _page_response(page_number, page.text, page.chunk_offsets).model_dump_json().encode()
+        if ready:
+            await cache.backend.set(key, body, cache.CACHE_TTL_SECONDS)
 
-    full_text = ""
-    chunks: list[str] = []
-    for chunk in page_chunks:
-        t = chunk.text or ""
-        full_text += t
-        chunks.append(t)
+    return cache.json_response(request, body)
 
+def _page_response(page_number: int, text: Optional[str], offsets: List[int]) -> DocumentPageResponse:
+    chunks = utils.chunks_from_offsets(text, offsets)
     return DocumentPageResponse(
         page_number=page_number,
-        text=full_text,
+        text=text or "",
         chunks=chunks if len(chunks) > 1 else [],
     )
 
+async def stream_pages(sha256: str, first: int, last: Optional[int], header: bytes = b""):
+    """
+    Yields NDJSON page lines for pages first..last from a single server-side
+    cursor, flushing in STREAM_FLUSH_BYTES pieces. Opens its own session because
+    the request's session is closed once the handler returns.
+    """
+    query = (
+        select(DocumentPage.page_number, DocumentPage.text, DocumentPage.chunk_offsets)
+        .where(DocumentPage.sha256 == sha256, DocumentPage.page_number >= first)
+        .order_by(DocumentPage.page_number)
+        .execution_options(yield_per=STREAM_YIELD_PER)
+    )
+    if last is not None:
+        query = query.where(DocumentPage.page_number <= last)
+
+    buffer = bytearray(header)
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query)
+        async for row in result:
+            buffer += _page_response(row.page_number, row.text, row.chunk_offsets).model_dump_json().encode()
+            buffer += b"\n"
+            if len(buffer) >= STREAM_FLUSH_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+@app.get("/documents/{document_id}/progress")
+async def document_progress(
+    document_id: str,
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    """Server-Sent Events with status, pages_done and page_count until processing ends."""
+    document = await db.get(Document, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    return StreamingResponse(
+        progress.stream_progress(progress.document_state(document)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/documents/{document_id}/similar", response_model=list[SimilarDocument])
+async def similar_documents(
+    document_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    min_similarity: float = Query(0.5, ge=0, le=1),
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    """
+    Documents whose text is estimated (MinHash) to be at least min_similarity alike,
+    most similar first. Uploads of the identical file score 1.0.
+    """
+    document = await db.get(Document, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    blob = await db.get(Blob, document.sha256) if document.sha256 else None
+    if blob is None:
+        return []
+
+    scores = dict(await similarity.find_similar(db, blob, min_similarity))
+    scores[blob.sha256] = 1.0
+    rows = (
+        await db.execute(
+            select(Document.id, Document.filename, Document.sha256)
+            .where(Document.sha256.in_(scores), Document.id != document_id)
+        )
+    ).all()
+    rows.sort(key=lambda row: (-scores[row.sha256], row.id))
+    return [
+        SimilarDocument(
+            document_id=row.id,
+            filename=row.filename,
+            similarity=round(scores[row.sha256], 4),
+            near_duplicate=scores[row.sha256] >= similarity.NEAR_DUPLICATE_THRESHOLD,
+        )
+        for row in rows[:limit]
+    ]
+
+@app.get("/documents/{document_id}/pages")
+async def get_document_pages(
+    document_id: str,
+    from_: int = Query(1, alias="from", ge=1),
+    to: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    document = await db.get(Document, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if to is not None and to < from_:
+        raise HTTPException(status_code=400, detail="'to' must not be less than 'from'")
+
+    return StreamingResponse(stream_pages(document.sha256, from_, to), media_type="application/x-ndjson")
+
+@app.get("/documents/{document_id}/export")
+async def export_document(
+    document_id: str,
+    db: AsyncSession = Depends(get_db),
+    _api_key_valid: bool = Depends(verify_api_key),
+):
+    document = await db.get(Document, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # first line is the document, then one line per page
+    header = DocumentResponse.model_validate(document).model_dump_json().encode() + b"\n"
+    return StreamingResponse(
+        stream_pages(document.sha256, 1, None, header),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{document_id}.ndjson"'},
+    )
+
 @app.delete("/documents/{document_id}")
 async def delete_document(
     document_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _api_key_valid: bool = Depends(verify_api_key),
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
     try:
-        storage_root = os.getenv("STORAGE_FOLDER", str(Path.cwd() / "storage"))
-        storage_filename = f"{document_id}.pdf"
-        file_path = os.path.join(storage_root, storage_filename)
-
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        blob = await db.get(Blob, document.sha256, with_for_update=True) if document.sha256 else None
+        await db.delete(document)
+
+        if blob is not None:
+            blob.ref_count -= 1
+            if blob.ref_count <= 0:
+                # last reference: drop the shared pages, similarity index entries, jobs and file
+                await db.execute(delete(DocumentPage).where(DocumentPage.sha256 == blob.sha256))
+                await db.execute(delete(BlobBand).where(BlobBand.sha256 == blob.sha256))
+                await db.execute(
+                    update(Blob).where(Blob.near_duplicate_of == blob.sha256).values(near_duplicate_of=None)
+                )
+                await db.execute(delete(ProcessingJob).where(ProcessingJob.sha256 == blob.sha256))
+                await db.delete(blob)
+                # removed while the row lock is held, so an upload of the same content
+                # waiting on that lock stores its file after this
+                await run_in_threadpool(storage.delete_blob, blob.sha256)
 
-        db.delete(document)
-        db.commit()
+        await db.commit()
+        await cache.invalidate_search()
 
         logger.info(f"Document deleted: {document.filename}")
         return {"message": "Document deleted successfully"}
@@ -258,90 +454,119 @@ async def delete_document(
         logger.error(f"Error deleting document: {e}")
         raise HTTPException(status_code=500, detail="Delete failed")
 
-@app.get("/documents/{document_id}/download")
+@app.api_route("/documents/{document_id}/download", methods=["GET", "HEAD"])
 async def download_document(
     document_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     _api_key_valid: bool = Depends(verify_api_key),
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
-
-    storage_root = os.getenv("STORAGE_FOLDER", str(Path.cwd() / "storage"))
-    storage_filename = f"{document_id}.pdf"
-    file_path = os.path.join(storage_root, storage_filename)
-
-    if not os.path.exists(file_path):
+    if not document.sha256:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=file_path,
-        filename=document.filename,
-        media_type="application/pdf",
-    )
+    return await downloads.blob_response(request, document.sha256, document.filename)
 
 @app.get("/search", response_model=list[SearchResult])
 async def search_documents(
+    request: Request,
     q: str = Query(..., min_length=1),
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _api_key_valid: bool = Depends(verify_api_key),
 ):
     logger.info(f"Search: '{q}'")
-    search_term = f"%{q.lower()}%"
-
-    results = (
-        db.query(DocumentPage, Document)
-        .join(Document, DocumentPage.document_id == Document.id) 
-        .filter(DocumentPage.text.ilike(search_term))
-        .limit(limit)
-        .all()
-    )
 
-    search_results: list[SearchResult] = []
-    for page, document in results:
-        text_lower = (page.text or "").lower()
-        search_lower = q.lower()
-
-        pos = text_lower.find(search_lower)
-        if pos >= 0:
-            start = max(0, pos - 50)
-            end = min(len(page.text or ""), pos + len(q) + 50)
-            snippet = (page.text or "")[start:end]
-            if start > 0:
-                snippet = "..." + snippet
-            if end < len(page.text or ""):
-                snippet = snippet + "..."
-        else:
-            sample = (page.text or "")
-            snippet = (sample[:100] + "...") if sample else ""
-
-        search_results.append(
+    key = await cache.search_key(q, limit, await search.pages_version(db))
+    body = await cache.backend.get(key)
+    if body is None:
+        async with admission.search_limiter.slot():
+            try:
+                rows = await search.search_pages(db, q, limit)
+            except search.SearchTimeout as e:
+                logger.warning(f"Search timed out: '{q}'")
+                raise admission.overloaded(
+                    "search_timeout", "Search took too long; try a more specific query"
+                ) from e
+        results = [
             SearchResult(
-                document_id=document.id,
-                filename=document.filename,
-                page_number=page.page_number,
-                text_snippet=snippet,
+                document_id=row.document_id,
+                filename=row.filename,
+                page_number=row.page_number,
+                text_snippet=search.highlight_snippet(row.snippet),
+                score=row.score,
             )
-        )
+            for row in rows
+        ]
+        body = search_results_adapter.dump_json(results)
+        await cache.backend.set(key, body, cache.SEARCH_CACHE_TTL_SECONDS)
 
-    return search_results
+    return cache.json_response(request, body)
 
 @app.get("/")
 def read_root():
     return {"message": "Hello World"}
 
-@app.get("/health", response_model=HealthResponse)
-async def health_check(db: Session = Depends(get_db)):
-    db_working = True
+async def _queue_families(db: AsyncSession) -> list:
+    """Job queue and document gauges, read from the database."""
+    queue = metrics.GaugeMetricFamily("processing_jobs", "Processing jobs by status", labels=["status"])
+    for status, count in await db.execute(
+        select(ProcessingJob.status, func.count()).group_by(ProcessingJob.status)
+    ):
+        queue.add_metric([status], count)
+
+    oldest = (await db.execute(
+        select(func.min(ProcessingJob.available_at)).where(ProcessingJob.status == "queued")
+    )).scalar()
+    queue_age = metrics.GaugeMetricFamily(
+        "processing_queue_oldest_age_seconds", "Age of the oldest runnable queued job"
+    )
+    queue_age.add_metric([], max((datetime.utcnow() - oldest).total_seconds(), 0) if oldest else 0)
+
+    documents = metrics.GaugeMetricFamily("documents", "Documents by status", labels=["status"])
+    for status, count in await db.execute(select(Document.status, func.count()).group_by(Document.status)):
+        documents.add_metric([status], count)
+    return [queue, queue_age, documents]
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(db: AsyncSession = Depends(get_db)):
     try:
-        db.execute(text("SELECT 1"))
-    except Exception:
-        db_working = False
+        families = await _queue_families(db)
+    except Exception as e:
+        # the process metrics matter most when the database is down; serve them without these
+        logger.warning(f"Skipping database metrics: {e!r}")
+        await db.rollback()
+        families = []
+    body = metrics.render(families)
+    return Response(content=body, media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check():
+    """Readiness details with a 200 either way; probes should use /health/live and /health/ready."""
+    db_working, problem = await health.readiness.check()
+    return HealthResponse(
+        status="healthy" if problem is None else "unhealthy",
+        fastapi_version=fastapi.__version__,
+        db_connection=db_working,
+        detail=problem,
+    )
 
+@app.get("/health/live")
+def liveness():
+    """The process is up and serving; no dependencies are checked."""
+    return {"status": "alive"}
+
+@app.get("/health/ready", response_model=HealthResponse)
+async def readiness(response: Response):
+    """503 until the database answers and the schema is migrated; checked at most every HEALTH_CACHE_SECONDS."""
+    db_working, problem = await health.readiness.check()
+    if problem is not None:
+        response.status_code = 503
     return HealthResponse(
-        status="healthy" if db_working else "unhealthy",
+        status="ready" if problem is None else "unavailable",
         fastapi_version=fastapi.__version__,
         db_connection=db_working,
+        detail=problem,
     )
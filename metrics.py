@@ -0,0 +1,221 @@
+"""
+Prometheus metrics, request IDs and slow-query logging.
+
+Counters and histograms are per process. Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+to a shared, empty directory so /metrics aggregates every web worker (and a worker
+process on the same machine); otherwise each process reports only itself. The
+processing worker can also serve its own metrics on WORKER_METRICS_PORT.
+"""
+import contextvars
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Iterable, Iterator, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("metrics")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 disables slow-query logging
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "document_stage_duration_seconds",
+    "Time per document in each processing stage (parse, extract, chunk, insert, minhash, total)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+PAGE_EXTRACT_SECONDS = Histogram(
+    "pdf_page_extract_duration_seconds", "Text extraction time per PDF page", buckets=PAGE_BUCKETS
+)
+PAGES_EXTRACTED = Counter("pdf_pages_extracted_total", "PDF pages extracted")
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total", "Requests shed by admission control", ["reason"]
+)
+NEAR_DUPLICATES = Counter("documents_near_duplicate_total", "Processed blobs flagged as near duplicates")
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["engine"], buckets=PAGE_BUCKETS
+)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Pooled connection checkouts", ["engine"])
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ["engine"])
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_engines = {}
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds %(request_id)s to log records: the current request's ID, or the worker's job."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def install_log_filter() -> None:
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request by route template, and assigns it a request ID: the
+    caller's X-Request-ID if it looks sane, otherwise a new one. The ID is echoed
+    in the response and attached to log lines.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if _REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def tracking_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, tracking_send)
+        finally:
+            route = scope.get("route")
+            # the template, not the raw path, keeps label cardinality bounded
+            REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+            request_id_var.reset(token)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_pages(page_seconds: Iterable[float]) -> None:
+    count = 0
+    for seconds in page_seconds:
+        PAGE_EXTRACT_SECONDS.observe(seconds)
+        count += 1
+    PAGES_EXTRACTED.inc(count)
+
+
+class TimedIterator:
+    """Wraps a lazy iterator and adds up the time spent producing its items."""
+
+    def __init__(self, items: Iterable):
+        self.items = iter(items)
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self.items)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Pool checkout wait/count metrics and, when SLOW_QUERY_MS is set, slow-query logging."""
+    _engines[name] = engine
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        # _do_get is where QueuePool blocks for a free connection; there is no pool
+        # event that fires before the wait, so time it here
+        do_get = pool._do_get
+
+        def timed_do_get():
+            started = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                DB_POOL_WAIT_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+        pool._do_get = timed_do_get
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKOUTS.labels(name).inc()
+
+    if SLOW_QUERY_MS <= 0:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            DB_SLOW_QUERIES.labels(name).inc()
+            logger.warning(f"Slow query ({elapsed_ms:.0f} ms) on {name}: {' '.join(statement.split())[:500]}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+
+def pool_families() -> List[GaugeMetricFamily]:
+    """Point-in-time pool state of this process's engines."""
+    size = GaugeMetricFamily("db_pool_size", "Configured pool size", labels=["engine"])
+    checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections currently checked out", labels=["engine"])
+    overflow = GaugeMetricFamily("db_pool_overflow", "Connections open beyond pool_size", labels=["engine"])
+    for name, engine in _engines.items():
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+    return [size, checked_out, overflow]
+
+
+class _Snapshot:
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def render(extra_families: Optional[list] = None) -> bytes:
+    """Prometheus text exposition of this process (or all, in multiprocess mode) plus snapshot gauges."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        output = generate_latest(registry)
+    else:
+        from prometheus_client import REGISTRY
+
+        output = generate_latest(REGISTRY)
+
+    snapshot = CollectorRegistry(auto_describe=False)
+    snapshot.register(_Snapshot(pool_families() + list(extra_families or [])))
+    return output + generate_latest(snapshot)
@@ -0,0 +1,395 @@
+"""
+Versioned schema migrations, applied once per deploy by the Procfile's release
+phase, not by the web or worker processes:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # show the schema version
+
+Applied versions are recorded in schema_migrations with their names; a recorded
+version whose name no longer matches is applied again. Every step is idempotent and
+checks the schema it finds, so it is safe to re-run on a partly upgraded database,
+and a database from any earlier release, back to per-document files and string page
+ids, upgrades in one run.
+On PostgreSQL an advisory lock keeps concurrent runs from racing. Runs use an engine
+without statement_timeout (database.create_migration_engine).
+"""
+import hashlib
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, delete, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import jobs
+import models
+import page_writer
+import search
+import storage
+from models import DocumentPage, ProcessingJob
+
+logger = logging.getLogger("migrations")
+
+# PostgreSQL column compression for page text: lz4 (needs a server built with lz4) or pglz
+PAGE_TEXT_COMPRESSION = os.getenv("PAGE_TEXT_COMPRESSION", "").lower()
+# rows longer than this are compressed; the PostgreSQL default (~2 kB) skips most pages
+PAGE_TOAST_TUPLE_TARGET = int(os.getenv("PAGE_TOAST_TUPLE_TARGET", "512"))
+
+MIGRATION_LOCK_ID = 726_301
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            conn.commit()
+
+
+def _legacy_page_rows(engine: Engine, sha256: str) -> Iterator[dict]:
+    """Regroups one blob's chunk rows into page rows, keeping the original chunk boundaries."""
+    with engine.connect() as conn:
+        chunks = conn.execute(
+            text(
+                "SELECT page_number, text FROM document_pages_legacy "
+                "WHERE sha256 = :sha256 ORDER BY page_number, chunk_index"
+            ),
+            {"sha256": sha256},
+        ).all()
+
+    for page_number, rows in groupby(chunks, key=lambda row: row.page_number):
+        parts = [row.text or "" for row in rows]
+        offsets, length = [], 0
+        for part in parts:
+            offsets.append(length)
+            length += len(part)
+        yield {"sha256": sha256, "page_number": page_number, "text": "".join(parts), "chunk_offsets": offsets}
+
+
+def _columns(engine: Engine, table: str) -> set:
+    inspector = inspect(engine)
+    return {column["name"] for column in inspector.get_columns(table)} if inspector.has_table(table) else set()
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(storage.READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_legacy_files(engine: Engine) -> None:
+    """Moves each STORAGE_FOLDER/{id}.pdf into the blob store under its hash and records it on the document."""
+    root = storage.get_storage_root()
+    with engine.connect() as conn:
+        documents = conn.execute(text("SELECT id, sha256 FROM documents")).all()
+
+    for document_id, sha256 in documents:
+        legacy_path = os.path.join(root, f"{document_id}.pdf")
+        if os.path.exists(legacy_path):
+            sha256 = _file_sha256(legacy_path)
+            # recorded before the move, so an interrupted run finds either the file or the blob
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE documents SET sha256 = :sha256 WHERE id = :id"),
+                             {"sha256": sha256, "id": document_id})
+            if storage.backend.stat(sha256) is None:
+                storage.backend.put(legacy_path, sha256)
+            else:
+                os.remove(legacy_path)
+        elif sha256 is None or storage.backend.stat(sha256) is None:
+            logger.warning(f"Document {document_id} has no stored file; marking it failed")
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE documents SET sha256 = NULL, status = 'failed' WHERE id = :id"),
+                             {"id": document_id})
+
+
+def migrate_document_blobs(engine: Engine) -> bool:
+    """
+    Converts databases that store a file and pages per document to content-addressed
+    blobs: each {id}.pdf moves to blobs/aa/bb/ under its SHA-256, documents with the
+    same hash share one blobs row (ref_count, status), and pages and jobs are keyed by
+    sha256 instead of document_id. Returns True if it migrated.
+    """
+    if not inspect(engine).has_table("documents"):
+        return False
+    page_columns = _columns(engine, "document_pages")
+    job_columns = _columns(engine, "processing_jobs")
+    if inspect(engine).has_table("blobs") and "document_id" not in page_columns | job_columns:
+        return False
+
+    logger.info("Migrating stored documents to content-addressed blobs")
+    with engine.begin() as conn:
+        # the blobs table as first introduced; later steps add the columns that came after it
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "sha256 VARCHAR(64) NOT NULL PRIMARY KEY, size INTEGER NOT NULL, ref_count INTEGER NOT NULL, "
+            "page_count INTEGER, status VARCHAR NOT NULL, created_at TIMESTAMP)"
+        ))
+        if "document_id" in job_columns:
+            # jobs are recreated below for every blob that still needs processing
+            conn.execute(text("DROP TABLE processing_jobs"))
+        if page_columns and "sha256" not in page_columns:
+            conn.execute(text("ALTER TABLE document_pages ADD COLUMN sha256 VARCHAR(64)"))
+    ProcessingJob.__table__.create(engine, checkfirst=True)
+
+    _hash_legacy_files(engine)
+
+    with engine.connect() as conn:
+        existing = set(conn.execute(text("SELECT sha256 FROM blobs")).scalars())
+        documents = conn.execute(text(
+            "SELECT id, sha256, size, page_count, status, created_at FROM documents "
+            "WHERE sha256 IS NOT NULL ORDER BY sha256, created_at"
+        )).all()
+        with_pages = set()
+        if "document_id" in page_columns:
+            with_pages = set(conn.execute(text("SELECT DISTINCT document_id FROM document_pages")).scalars())
+
+    db = Session(bind=engine)
+    try:
+        for sha256, group in groupby(documents, key=lambda row: row.sha256):
+            if sha256 in existing:
+                continue
+            group = list(group)
+            source = next((row for row in group if row.status == "ready" and row.id in with_pages), None)
+            if source is not None:
+                status, page_count = "ready", source.page_count
+            elif all(row.status == "failed" for row in group):
+                status, page_count = "failed", None
+            else:
+                status, page_count = "processing", None
+
+            # one transaction per blob: its row, its pages and its documents move together
+            db.execute(
+                text(
+                    "INSERT INTO blobs (sha256, size, ref_count, page_count, status, created_at) "
+                    "VALUES (:sha256, :size, :ref_count, :page_count, :status, :created_at)"
+                ),
+                {"sha256": sha256, "size": group[0].size, "ref_count": len(group), "page_count": page_count,
+                 "status": status, "created_at": group[0].created_at or datetime.utcnow()},
+            )
+            if source is not None and "document_id" in page_columns:
+                db.execute(text("UPDATE document_pages SET sha256 = :sha256 WHERE document_id = :id"),
+                           {"sha256": sha256, "id": source.id})
+            jobs.set_blob_status(db, sha256, status, page_count)
+            if status == "processing":
+                jobs.enqueue_job(db, sha256)
+            db.commit()
+    finally:
+        db.close()
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_documents_sha256 ON documents (sha256)"))
+        if engine.dialect.name == "postgresql" and not any(
+            fk["referred_table"] == "blobs" for fk in inspect(engine).get_foreign_keys("documents")
+        ):
+            conn.execute(text(
+                "ALTER TABLE documents ADD CONSTRAINT documents_sha256_fkey "
+                "FOREIGN KEY (sha256) REFERENCES blobs (sha256)"
+            ))
+    logger.info(f"Migrated {len(documents)} documents to {len({row.sha256 for row in documents})} blobs")
+    return True
+
+
+def add_document_indexes(engine: Engine) -> None:
+    """Adds the GET /documents pagination and status indexes to documents tables created before them."""
+    if not inspect(engine).has_table("documents"):
+        return
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_documents_created_at_id ON documents (created_at, id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_documents_status ON documents (status)"))
+
+
+def migrate_page_storage(engine: Engine) -> bool:
+    """
+    Converts document_pages from one row per chunk (chunk_index) to one row per page
+    with chunk offsets. The old table is renamed to document_pages_legacy and copied
+    blob by blob; an interrupted run starts the copy over. Chunk rows without a sha256
+    (duplicates left by migrate_document_blobs) are dropped. The new table also replaces
+    string page ids with the integer id bulk inserts rely on. Returns True if it migrated.
+    """
+    tables = set(inspect(engine).get_table_names())
+    if "document_pages" in tables and "document_pages_legacy" not in tables:
+        columns = {column["name"] for column in inspect(engine).get_columns("document_pages")}
+        if "chunk_index" in columns:
+            if "sha256" not in columns:
+                # checked before the rename, so a failed run leaves the schema as it found it
+                raise RuntimeError("document_pages is still keyed by document_id; run migrate_document_blobs first")
+            logger.info("Migrating document_pages to one row per page")
+            search.drop_search_index(engine)
+            with engine.begin() as conn:
+                conn.execute(text("DROP INDEX IF EXISTS ix_document_pages_sha256_page_chunk"))
+                conn.execute(text("ALTER TABLE document_pages RENAME TO document_pages_legacy"))
+                if engine.dialect.name == "postgresql":
+                    # free the names the new table's primary key and id sequence will use
+                    conn.execute(text("ALTER INDEX IF EXISTS document_pages_pkey RENAME TO document_pages_legacy_pkey"))
+                    conn.execute(text(
+                        "ALTER SEQUENCE IF EXISTS document_pages_id_seq RENAME TO document_pages_legacy_id_seq"
+                    ))
+            tables.add("document_pages_legacy")
+    if "document_pages_legacy" not in tables:
+        return False
+
+    DocumentPage.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        blobs: List[str] = conn.execute(
+            text("SELECT DISTINCT sha256 FROM document_pages_legacy WHERE sha256 IS NOT NULL")
+        ).scalars().all()
+
+    db = Session(bind=engine)
+    try:
+        db.execute(delete(DocumentPage))
+        db.commit()
+        pages = 0
+        for sha256 in blobs:
+            pages += page_writer.write_page_rows(db, _legacy_page_rows(engine, sha256))
+    finally:
+        db.close()
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE document_pages_legacy"))
+    logger.info(f"Migrated {pages} pages of {len(blobs)} blobs")
+    return True
+
+
+def add_progress_columns(engine: Engine) -> None:
+    """Adds pages_done to blobs and documents from before progress tracking; ready ones count every page."""
+    for table in ("blobs", "documents"):
+        columns = {column["name"] for column in inspect(engine).get_columns(table)}
+        if "pages_done" in columns:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN pages_done INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text(
+                f"UPDATE {table} SET pages_done = page_count WHERE status = 'ready' AND page_count IS NOT NULL"
+            ))
+        logger.info(f"Added {table}.pages_done")
+
+
+def _add_column(engine: Engine, table: str, name: str, ddl: str) -> bool:
+    """Adds a column to an existing table unless it is already there. Returns True if it added it."""
+    inspector = inspect(engine)
+    if not inspector.has_table(table) or name in {column["name"] for column in inspector.get_columns(table)}:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    logger.info(f"Added {table}.{name}")
+    return True
+
+
+def add_document_sha256(engine: Engine) -> None:
+    """Adds documents.sha256 to databases from before uploads were hashed."""
+    _add_column(engine, "documents", "sha256", "VARCHAR(64)")
+
+
+def add_job_pool_crashes(engine: Engine) -> None:
+    """Adds processing_jobs.pool_crashes; existing jobs start from zero."""
+    _add_column(engine, "processing_jobs", "pool_crashes", "INTEGER NOT NULL DEFAULT 0")
+
+
+def add_similarity_columns(engine: Engine) -> None:
+    """Adds the MinHash columns to blobs; existing blobs get signatures from `python similarity.py backfill`."""
+    binary = "BYTEA" if engine.dialect.name == "postgresql" else "BLOB"
+    _add_column(engine, "blobs", "minhash", binary)
+    _add_column(engine, "blobs", "near_duplicate_of", "VARCHAR(64)")
+
+
+def configure_page_compression(engine: Engine) -> None:
+    """Applies PAGE_TEXT_COMPRESSION to document_pages.text; affects newly written pages."""
+    if engine.dialect.name != "postgresql" or PAGE_TEXT_COMPRESSION not in ("lz4", "pglz"):
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE document_pages ALTER COLUMN text SET COMPRESSION {PAGE_TEXT_COMPRESSION}"))
+            conn.execute(text(f"ALTER TABLE document_pages SET (toast_tuple_target = {PAGE_TOAST_TUPLE_TARGET})"))
+    except Exception as e:
+        logger.warning(f"Could not enable {PAGE_TEXT_COMPRESSION} compression for page text: {e}")
+
+
+def create_tables(engine: Engine) -> None:
+    models.Base.metadata.create_all(bind=engine)
+
+
+# (version, name, step) in the order they apply
+MIGRATIONS: List[Tuple[int, str, Callable[[Engine], object]]] = [
+    (1, "document_sha256", add_document_sha256),
+    (2, "blob_storage", migrate_document_blobs),
+    (3, "document_indexes", add_document_indexes),
+    (4, "page_storage", migrate_page_storage),
+    (5, "create_tables", create_tables),
+    (6, "progress_columns", add_progress_columns),
+    (7, "search_index", search.ensure_search_index),
+    (8, "similarity_columns", add_similarity_columns),
+    (9, "job_pool_crashes", add_job_pool_crashes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """The highest applied version, or None before the first migration run."""
+    if not inspect(engine).has_table(schema_migrations.name):
+        return None
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(schema_migrations.c.version))).scalar()
+
+
+def upgrade(engine: Engine) -> int:
+    """Applies pending migrations in order, recording each one. Returns the number applied."""
+    with _migration_lock(engine):
+        schema_migrations.create(engine, checkfirst=True)
+        expected = {version: name for version, name, _ in MIGRATIONS}
+        with engine.begin() as conn:
+            applied = set()
+            for version, name in conn.execute(select(schema_migrations.c.version, schema_migrations.c.name)):
+                if expected.get(version) == name:
+                    applied.add(version)
+                else:
+                    logger.warning(f"Recorded migration {version} ({name}) doesn't match this release; re-applying")
+                    conn.execute(schema_migrations.delete().where(schema_migrations.c.version == version))
+
+        count = 0
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            step(engine)
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(version=version, name=name))
+            count += 1
+
+        # settings rather than schema: re-applied every run so changing the env takes effect
+        configure_page_compression(engine)
+    logger.info(f"Schema at version {LATEST_VERSION} ({count} migration(s) applied)")
+    return count
+
+
+if __name__ == "__main__":
+    from database import create_migration_engine
+
+    engine = create_migration_engine()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if sys.argv[1:] == ["--status"]:
+        version = current_version(engine)
+        print(f"schema version {version} of {LATEST_VERSION}")
+        sys.exit(0 if version == LATEST_VERSION else 1)
+    upgrade(engine)
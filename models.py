@@ -1,33 +1,90 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, BigInteger, Text, ForeignKey, DateTime, Index, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 
+class Blob(Base):
+    """A stored PDF, addressed by the SHA-256 of its content and shared by every Document that uploaded it."""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    page_count = Column(Integer, nullable=True)
+    # pages extracted and stored so far; readable before the blob is ready
+    pages_done = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="processing")  # processing, ready, failed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # MinHash signature of the page text (similarity.NUM_PERM little-endian uint32s)
+    minhash = Column(LargeBinary, nullable=True)
+    # the most similar blob processed earlier, when at least NEAR_DUPLICATE_THRESHOLD alike
+    near_duplicate_of = Column(String(64), nullable=True)
+
+    documents = relationship("Document", back_populates="blob")
+
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        # keyset pagination order for GET /documents
+        Index("ix_documents_created_at_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     filename = Column(String, nullable=False)
     size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)
     page_count = Column(Integer, nullable=True)
-    status = Column(String, nullable=False, default="processing")
+    pages_done = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="processing", index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    pages = relationship(
-        "DocumentPage",
-        back_populates="document",
-        cascade="all, delete-orphan",
-    )
+    blob = relationship("Blob", back_populates="documents")
 
 class DocumentPage(Base):
+    """
+    The extracted text of one page, stored once per blob so identical uploads share it.
+    Chunks aren't stored separately: chunk i is text[chunk_offsets[i]:chunk_offsets[i + 1]].
+    """
     __tablename__ = "document_pages"
+    __table_args__ = (
+        Index("ix_document_pages_sha256_page", "sha256", "page_number", unique=True),
+    )
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    # integer rowid so the SQLite FTS index can reference rows
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False)
     page_number = Column(Integer, nullable=False)
-    text = Column(Text)
-    chunk_index = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    text = Column(Text, nullable=False, default="")
+    chunk_offsets = Column(JSON, nullable=False, default=lambda: [0])
+
+class BlobBand(Base):
+    """One LSH band of a blob's MinHash signature; blobs sharing a (band, bucket) are similarity candidates."""
+    __tablename__ = "blob_lsh_bands"
+    __table_args__ = (
+        Index("ix_blob_lsh_bands_band_bucket", "band", "bucket"),
+    )
 
-    document = relationship("Document", back_populates="pages")
\ No newline at end of file
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), primary_key=True)
+    band = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger, nullable=False)
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+    __table_args__ = (
+        Index("ix_processing_jobs_status_available_at", "status", "available_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # times the extraction process pool died while running this job; not counted as attempts
+    pool_crashes = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
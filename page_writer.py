@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import os
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import utils
+from models import DocumentPage
+
+logger = logging.getLogger("page_writer")
+
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "2000"))
+# COPY FROM STDIN on PostgreSQL; set to 0 to use batched INSERTs everywhere
+INSERT_USE_COPY = os.getenv("INSERT_USE_COPY", "1") == "1"
+
+COLUMNS = ("sha256", "page_number", "text", "chunk_offsets")
+
+
+def iter_page_rows(sha256: str, pages_text: Iterable[str], chunk_size: int, first_page: int = 1) -> Iterator[dict]:
+    """Yields one row dict per page, numbering pages from first_page, with the page's chunk offsets."""
+    for page_num, page_text in enumerate(pages_text, first_page):
+        # PostgreSQL text can't hold NUL bytes, which some PDFs produce
+        page_text = (page_text or "").replace("\x00", "")
+        yield {
+            "sha256": sha256,
+            "page_number": page_num,
+            "text": page_text,
+            "chunk_offsets": utils.chunk_offsets(page_text, chunk_size),
+        }
+
+
+def _copy_value(value) -> str:
+    if isinstance(value, list):
+        value = json.dumps(value)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_batch(db: Session, batch: List[dict]) -> bool:
+    """Streams the batch with COPY FROM STDIN. Returns False if the driver can't COPY."""
+    cursor = db.connection().connection.cursor()
+    try:
+        if not hasattr(cursor, "copy_expert"):
+            return False
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write("\t".join(_copy_value(row[column]) for column in COLUMNS))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY document_pages ({', '.join(COLUMNS)}) FROM STDIN", buffer)
+        return True
+    finally:
+        cursor.close()
+
+
+def write_page_rows(db: Session, rows: Iterable[dict], batch_size: int = INSERT_BATCH_SIZE) -> int:
+    """
+    Inserts page rows in batches of batch_size, committing after each batch so
+    memory use doesn't grow with the document. Uses COPY on PostgreSQL and
+    executemany (insertmanyvalues) elsewhere. Returns the number of rows written.
+    """
+    use_copy = INSERT_USE_COPY and db.get_bind().dialect.name == "postgresql"
+    rows = iter(rows)
+    written = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        if not (use_copy and _copy_batch(db, batch)):
+            use_copy = False
+            db.execute(insert(DocumentPage), batch)
+        db.commit()
+        written += len(batch)
+    return written
@@ -0,0 +1,53 @@
+import base64
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Document
+
+TOTAL_CACHE_SECONDS = float(os.getenv("DOCUMENT_TOTAL_CACHE_SECONDS", "30"))
+
+_total_cache: Tuple[float, Optional[int]] = (0.0, None)
+
+
+def encode_cursor(created_at: datetime, document_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), document_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, document_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(document_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def estimate_document_total(db: AsyncSession) -> int:
+    """
+    Approximate number of documents, cached for TOTAL_CACHE_SECONDS. PostgreSQL
+    reads the planner estimate from pg_class instead of scanning; other databases
+    (and never-analyzed tables) fall back to COUNT(*).
+    """
+    global _total_cache
+    cached_at, total = _total_cache
+    if total is not None and time.monotonic() - cached_at < TOTAL_CACHE_SECONDS:
+        return total
+
+    total = -1
+    if db.bind.dialect.name == "postgresql":
+        total = (await db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'documents'::regclass")
+        )).scalar() or -1
+    if total < 0:
+        total = (await db.execute(select(func.count()).select_from(Document))).scalar_one()
+
+    _total_cache = (time.monotonic(), total)
+    return total
@@ -0,0 +1,198 @@
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import utils
+import cache
+import jobs
+import metrics
+import page_writer
+import similarity
+from models import Blob, BlobBand, DocumentPage
+from database import SessionLocal
+
+logger = logging.getLogger("processing")
+
+# Pages handed to one pool task; large documents are split into ranges of this size.
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "25"))
+HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+# ranges submitted to the pool ahead of the one being stored; bounds the extracted
+# text held in memory for a large PDF (0 submits every range at once)
+MAX_INFLIGHT_RANGES = int(os.getenv("EXTRACT_MAX_INFLIGHT_RANGES", "8"))
+
+
+def _wait(futures, heartbeat: Optional[Callable[[], None]]) -> None:
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=HEARTBEAT_SECONDS)
+        if heartbeat:
+            heartbeat()
+
+
+class UnreadablePdf(Exception):
+    pass
+
+
+def iter_page_ranges(
+    file_path: str,
+    executor: Optional[Executor] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+) -> Iterator[Tuple[int, int, List[str]]]:
+    """
+    Yields (page_count, first page index, page texts) for consecutive page ranges,
+    in page order, as soon as each is extracted. Ranges are spread across the
+    executor's processes, at most EXTRACT_MAX_INFLIGHT_RANGES ahead of the
+    consumer; the first one also reports the page count, so the PDF
+    is never parsed just to count pages. heartbeat is called periodically while
+    waiting. Raises UnreadablePdf when any range can't be read.
+    """
+    if executor is None:
+        try:
+            page_count, pages_text = utils.extract_pdf_range(file_path)
+        except Exception as e:
+            raise UnreadablePdf(str(e)) from e
+        yield page_count, 0, pages_text
+        return
+
+    first = executor.submit(utils.extract_pdf_range_timed, file_path, 0, PAGES_PER_TASK)
+    _wait([first], heartbeat)
+    try:
+        page_count, pages_text, parse_seconds, page_seconds = first.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        raise UnreadablePdf(str(e)) from e
+    metrics.observe_stage("parse", parse_seconds)
+    metrics.observe_pages(page_seconds)
+
+    starts = iter(range(PAGES_PER_TASK, page_count, PAGES_PER_TASK))
+    window = MAX_INFLIGHT_RANGES if MAX_INFLIGHT_RANGES > 0 else page_count
+    inflight = deque()
+
+    def submit_next():
+        start = next(starts, None)
+        if start is not None:
+            future = executor.submit(utils.extract_pdf_range_timed, file_path, start, start + PAGES_PER_TASK)
+            inflight.append((start, future))
+
+    for _ in range(window):
+        submit_next()
+    yield page_count, 0, pages_text
+
+    while inflight:
+        start, future = inflight.popleft()
+        _wait([future], heartbeat)
+        try:
+            _, part, _, page_seconds = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            for _, pending in inflight:
+                pending.cancel()
+            raise UnreadablePdf(f"Page range starting at {start} could not be read: {e}") from e
+        submit_next()
+        metrics.observe_pages(page_seconds)
+        yield page_count, start, part
+
+
+def extract_pages(
+    file_path: str,
+    executor: Optional[Executor] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+) -> List[str]:
+    """All page texts of the PDF, or [] if it is unreadable."""
+    pages_text: List[str] = []
+    try:
+        for _, _, part in iter_page_ranges(file_path, executor, heartbeat):
+            pages_text.extend(part)
+    except UnreadablePdf as e:
+        logger.error(f"PDF read error in {file_path}: {e}")
+        return []
+    return pages_text
+
+
+def process_document_task(
+    sha256: str,
+    file_path: str,
+    executor: Optional[Executor] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+):
+    """
+    Extracts, chunks and stores the pages of an uploaded PDF, identified by its
+    content hash, and indexes its MinHash signature for similarity. Pages are
+    committed range by range with a pages_done counter, so they can be read while
+    the rest is extracted; at the end the blob and every document that references
+    it are marked ready. Unreadable PDFs are
+    marked failed; other errors propagate so the job is retried.
+    """
+    db = SessionLocal()
+    try:
+        logger.info(f"Processing blob: {sha256}")
+
+        blob = db.get(Blob, sha256)
+        if not blob:
+            logger.error(f"Blob not found: {sha256}")
+            return
+
+        # a retried job may find rows from an earlier attempt
+        db.query(DocumentPage).filter(DocumentPage.sha256 == sha256).delete(synchronize_session=False)
+        db.query(BlobBand).filter(BlobBand.sha256 == sha256).delete(synchronize_session=False)
+        jobs.set_blob_status(db, sha256, "processing", pages_done=0)
+        db.commit()
+
+        chunk_size = int(os.getenv("CHUNK_SIZE", "800"))
+        started = time.perf_counter()
+        ranges = metrics.TimedIterator(iter_page_ranges(file_path, executor, heartbeat))
+        chunk_seconds = insert_seconds = minhash_seconds = 0.0
+        pages_done = 0
+        minhash = similarity.MinHash()
+        try:
+            for page_count, first_index, pages_text in ranges:
+                write_started = time.perf_counter()
+                page_rows = metrics.TimedIterator(
+                    page_writer.iter_page_rows(sha256, pages_text, chunk_size, first_page=first_index + 1)
+                )
+                pages_done += page_writer.write_page_rows(db, page_rows)
+                jobs.set_blob_status(db, sha256, "processing", page_count=page_count, pages_done=pages_done)
+                db.commit()
+                # chunking runs lazily inside the insert loop; split the two by the time spent producing rows
+                chunk_seconds += page_rows.seconds
+                insert_seconds += time.perf_counter() - write_started - page_rows.seconds
+                minhash_started = time.perf_counter()
+                minhash.update(similarity.page_chunks(pages_text, chunk_size))
+                minhash_seconds += time.perf_counter() - minhash_started
+        except UnreadablePdf as e:
+            logger.error(f"PDF read error for blob {sha256}: {e}")
+            pages_done = 0
+
+        if pages_done == 0:
+            db.query(DocumentPage).filter(DocumentPage.sha256 == sha256).delete(synchronize_session=False)
+            jobs.set_blob_status(db, sha256, "failed", pages_done=0)
+            db.commit()
+            cache.invalidate_search_sync()
+            logger.error(f"Failed to extract text from: {sha256}")
+            return
+
+        metrics.observe_stage("extract", ranges.seconds)
+        metrics.observe_stage("chunk", chunk_seconds)
+        metrics.observe_stage("insert", insert_seconds)
+        minhash_started = time.perf_counter()
+        duplicate = similarity.index_blob(db, sha256, minhash)
+        metrics.observe_stage("minhash", minhash_seconds + time.perf_counter() - minhash_started)
+        if duplicate:
+            metrics.NEAR_DUPLICATES.inc()
+            logger.warning(f"Blob {sha256} is a near duplicate of {duplicate[0]} (similarity {duplicate[1]:.2f})")
+        jobs.set_blob_status(db, sha256, "ready", page_count=pages_done, pages_done=pages_done)
+        db.commit()
+        cache.invalidate_search_sync()
+        metrics.observe_stage("total", time.perf_counter() - started)
+        logger.info(f"Blob processed: {sha256} ({pages_done} pages in {time.perf_counter() - started:.2f}s)")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
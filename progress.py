@@ -0,0 +1,119 @@
+"""
+Server-Sent Events for processing progress.
+
+Every stream in a process shares one poller that reads the state of all watched
+documents with a single query per PROGRESS_POLL_SECONDS, so the database load
+doesn't grow with the number of clients waiting on a document.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import Document
+
+logger = logging.getLogger("progress")
+
+POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", "1"))
+KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_KEEPALIVE_SECONDS", "15"))
+TERMINAL_STATUSES = ("ready", "failed", "deleted")
+
+
+def document_state(document) -> dict:
+    return {
+        "id": document.id,
+        "status": document.status,
+        "pages_done": document.pages_done or 0,
+        "page_count": document.page_count,
+    }
+
+
+class ProgressPoller:
+    """Polls the documents that have subscribers and pushes changed states to their queues."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, poll_seconds: float = POLL_SECONDS):
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.last: Dict[str, dict] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, document_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.setdefault(document_id, set()).add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, document_id: str, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(document_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[document_id]
+            self.last.pop(document_id, None)
+
+    async def _run(self) -> None:
+        # stops by itself once the last stream has gone
+        while self.subscribers:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Progress poll failed: {e}")
+
+    async def poll(self) -> None:
+        ids = list(self.subscribers)
+        if not ids:
+            return
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(Document.id, Document.status, Document.pages_done, Document.page_count)
+                .where(Document.id.in_(ids))
+            )).all()
+        states = {row.id: document_state(row) for row in rows}
+        for document_id in ids:
+            state = states.get(document_id, {"id": document_id, "status": "deleted", "pages_done": 0, "page_count": None})
+            if self.last.get(document_id) == state:
+                continue
+            self.last[document_id] = state
+            for queue in self.subscribers.get(document_id, ()):
+                queue.put_nowait(state)
+
+
+poller = ProgressPoller()
+
+
+def _event(state: dict) -> bytes:
+    return f"event: progress\ndata: {json.dumps(state)}\n\n".encode()
+
+
+async def stream_progress(initial: dict) -> AsyncIterator[bytes]:
+    """
+    Yields SSE frames for one document: its current state, then every change until
+    it is ready, failed or deleted. Comment frames keep idle connections open.
+    """
+    yield f"retry: {int(POLL_SECONDS * 1000)}\n\n".encode()
+    yield _event(initial)
+    if initial["status"] in TERMINAL_STATUSES:
+        return
+
+    queue = poller.subscribe(initial["id"])
+    state = initial
+    try:
+        while state["status"] not in TERMINAL_STATUSES:
+            try:
+                update = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if update != state:
+                state = update
+                yield _event(state)
+    finally:
+        poller.unsubscribe(initial["id"], queue)
@@ -0,0 +1,206 @@
+import html
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import DocumentPage
+
+logger = logging.getLogger("search")
+
+HIGHLIGHT_START = "<b>"
+HIGHLIGHT_STOP = "</b>"
+# the database marks matches with these private-use characters; highlight_snippet escapes the
+# page text first and only then turns them into HIGHLIGHT_START/STOP, so PDFs can't inject HTML
+MATCH_START = "\ue000"
+MATCH_STOP = "\ue001"
+
+# Text search configuration used for the PostgreSQL tsvector column and queries.
+SEARCH_LANGUAGE = re.sub(r"[^a-z_]", "", os.getenv("SEARCH_LANGUAGE", "english").lower()) or "english"
+# PostgreSQL statement_timeout for search queries; lower than DB_STATEMENT_TIMEOUT_MS so
+# an expensive query gives its connection back quickly (0 keeps the connection default)
+STATEMENT_TIMEOUT_MS = int(os.getenv("SEARCH_STATEMENT_TIMEOUT_MS", "5000"))
+
+_QUERY_TOKEN = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """
+    Creates the full-text index for document_pages if it is missing.
+    PostgreSQL gets a generated tsvector column with a GIN index, SQLite an
+    external-content FTS5 table kept in sync by triggers. Safe to run repeatedly.
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            conn.execute(text(
+                "ALTER TABLE document_pages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_LANGUAGE}', coalesce(text, ''))) STORED"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_document_pages_search_vector "
+                "ON document_pages USING GIN (search_vector)"
+            ))
+        elif dialect == "sqlite":
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_pages_fts'"
+            )).first()
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS document_pages_fts USING fts5("
+                "text, content='document_pages', content_rowid='rowid', tokenize='porter unicode61')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS document_pages_fts_ai AFTER INSERT ON document_pages BEGIN "
+                "INSERT INTO document_pages_fts(rowid, text) VALUES (new.rowid, new.text); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS document_pages_fts_ad AFTER DELETE ON document_pages BEGIN "
+                "INSERT INTO document_pages_fts(document_pages_fts, rowid, text) "
+                "VALUES ('delete', old.rowid, old.text); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS document_pages_fts_au AFTER UPDATE ON document_pages BEGIN "
+                "INSERT INTO document_pages_fts(document_pages_fts, rowid, text) "
+                "VALUES ('delete', old.rowid, old.text); "
+                "INSERT INTO document_pages_fts(rowid, text) VALUES (new.rowid, new.text); END"
+            ))
+            if not exists:
+                # index rows that were stored before the FTS table existed
+                conn.execute(text("INSERT INTO document_pages_fts(document_pages_fts) VALUES ('rebuild')"))
+        else:
+            logger.warning(f"No full-text index support for dialect: {dialect}")
+
+
+def drop_search_index(engine: Engine) -> None:
+    """Removes what ensure_search_index created, e.g. before document_pages is rebuilt."""
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            conn.execute(text("DROP INDEX IF EXISTS ix_document_pages_search_vector"))
+            conn.execute(text("ALTER TABLE IF EXISTS document_pages DROP COLUMN IF EXISTS search_vector"))
+        elif dialect == "sqlite":
+            for trigger in ("document_pages_fts_ai", "document_pages_fts_ad", "document_pages_fts_au"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            conn.execute(text("DROP TABLE IF EXISTS document_pages_fts"))
+
+
+def to_fts5_query(q: str) -> str:
+    """
+    Translates a web-style query (terms, "quoted phrases", -exclusions, OR)
+    into FTS5 syntax. Every term is quoted so user input can't break the parser.
+    """
+    positive: List[str] = []
+    negative: List[str] = []
+    pending_or = False
+    for match in _QUERY_TOKEN.finditer(q):
+        negated, phrase, word = match.group(1), match.group(2), match.group(3)
+        if word is not None:
+            if word == "OR":
+                pending_or = bool(positive)
+                continue
+            negated = "-" if word.startswith("-") and len(word) > 1 else ""
+            phrase = word[1:] if negated else word
+        phrase = phrase.strip()
+        if not phrase:
+            continue
+        term = '"' + phrase.replace('"', '""') + '"'
+        if negated:
+            negative.append(term)
+        elif pending_or:
+            positive[-1] = f"{positive[-1]} OR {term}"
+        else:
+            positive.append(term)
+        pending_or = False
+
+    if not positive:
+        return ""
+    expr = " AND ".join(f"({term})" if " OR " in term else term for term in positive)
+    for term in negative:
+        expr = f"{expr} NOT {term}"
+    return expr
+
+
+def highlight_snippet(snippet: Optional[str]) -> str:
+    """HTML-escapes a snippet from the database and wraps its marked matches in HIGHLIGHT_START/STOP."""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_STOP, HIGHLIGHT_STOP)
+
+
+def build_search_query(dialect: str, q: str, limit: int) -> Tuple[object, dict]:
+    """
+    Returns (statement, params) for a ranked search over document_pages.
+    Rows carry document_id, filename, page_number, snippet and score (higher is better).
+    """
+    if dialect == "postgresql":
+        # rank first, then build headlines only for the rows that are returned
+        statement = text(
+            "SELECT hits.document_id, hits.filename, hits.page_number, hits.score, "
+            "ts_headline(CAST(:lang AS regconfig), hits.text, hits.tsq, :headline_options) AS snippet "
+            "FROM ("
+            "  SELECT d.id AS document_id, d.filename, p.page_number, p.text, query.tsq, "
+            "         ts_rank_cd(p.search_vector, query.tsq) AS score "
+            "  FROM document_pages p "
+            "  JOIN documents d ON d.sha256 = p.sha256, "
+            "       websearch_to_tsquery(CAST(:lang AS regconfig), :q) AS query(tsq) "
+            "  WHERE p.search_vector @@ query.tsq "
+            "  ORDER BY score DESC "
+            "  LIMIT :limit"
+            ") AS hits "
+            "ORDER BY hits.score DESC"
+        )
+        headline_options = (
+            f'StartSel="{MATCH_START}", StopSel="{MATCH_STOP}", '
+            'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" ... "'
+        )
+        return statement, {"lang": SEARCH_LANGUAGE, "q": q, "limit": limit, "headline_options": headline_options}
+
+    if dialect == "sqlite":
+        statement = text(
+            "SELECT d.id AS document_id, d.filename, p.page_number, "
+            "-bm25(document_pages_fts) AS score, "
+            "snippet(document_pages_fts, 0, :match_start, :match_stop, '...', 24) AS snippet "
+            "FROM document_pages_fts "
+            "JOIN document_pages p ON p.rowid = document_pages_fts.rowid "
+            "JOIN documents d ON d.sha256 = p.sha256 "
+            "WHERE document_pages_fts MATCH :q "
+            "ORDER BY bm25(document_pages_fts) "
+            "LIMIT :limit"
+        )
+        return statement, {"q": to_fts5_query(q), "limit": limit, "match_start": MATCH_START, "match_stop": MATCH_STOP}
+
+    raise ValueError(f"Full-text search not supported for dialect: {dialect}")
+
+
+async def pages_version(db: AsyncSession) -> int:
+    """The highest page id: grows whenever pages are stored, and costs one primary-key index probe."""
+    return (await db.execute(select(func.max(DocumentPage.id)))).scalar() or 0
+
+
+async def search_pages(db: AsyncSession, q: str, limit: int):
+    """
+    Runs the ranked search on the session's database and returns the result rows.
+    Raises SearchTimeout when PostgreSQL cancels it after SEARCH_STATEMENT_TIMEOUT_MS.
+    """
+    if not to_fts5_query(q):
+        # nothing but exclusions or punctuation; both backends would disagree on what that means
+        return []
+    dialect = db.bind.dialect.name
+    statement, params = build_search_query(dialect, q, limit)
+    if dialect == "postgresql" and STATEMENT_TIMEOUT_MS > 0:
+        # SET LOCAL lasts until the end of the session's transaction
+        await db.execute(text(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}"))
+    try:
+        return (await db.execute(statement, params)).all()
+    except DBAPIError as e:
+        if getattr(e.orig, "sqlstate", None) == "57014":  # query_canceled
+            raise SearchTimeout(f"Search exceeded {STATEMENT_TIMEOUT_MS} ms") from e
+        raise
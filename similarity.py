@@ -0,0 +1,210 @@
+"""
+Near-duplicate and related-document detection with MinHash signatures and LSH banding.
+
+Each blob gets a MINHASH_PERMUTATIONS x uint32 signature over word shingles of its
+chunk text, stored on the blob, and MINHASH_BANDS band hashes in blob_lsh_bands.
+Blobs that share a band bucket are candidates; only those are scored, so a lookup
+costs a few index probes instead of a scan over every blob. Everything runs locally.
+
+Index blobs processed before signatures existed with:
+
+    python similarity.py backfill
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import utils
+from models import Blob, BlobBand, DocumentPage
+
+if TYPE_CHECKING:
+    import numpy
+
+# numpy is imported on first use, so web workers that never score a document don't pay for it at boot
+
+logger = logging.getLogger("similarity")
+
+NUM_PERM = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+BANDS = int(os.getenv("MINHASH_BANDS", "32"))
+SHINGLE_WORDS = int(os.getenv("MINHASH_SHINGLE_WORDS", "3"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+# candidates scored per lookup; very common buckets (boilerplate) can't blow up a query
+MAX_CANDIDATES = int(os.getenv("MINHASH_MAX_CANDIDATES", "500"))
+BLOCK_SIZE = 4096
+
+if NUM_PERM % BANDS:
+    raise ValueError("MINHASH_PERMUTATIONS must be a multiple of MINHASH_BANDS")
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+PRIME = 4294967291  # largest prime below 2**32
+MAX_HASH = 2**32 - 1
+
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=None)
+def _permutations() -> Tuple["numpy.ndarray", "numpy.ndarray"]:
+    """
+    Coefficients of the universal hashes (a * x + b) mod PRIME over 32-bit shingle
+    hashes; a < 2**31 keeps a * x + b inside uint64. Fixed seed: signatures must
+    agree across processes and deploys.
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, 2**31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+    b = rng.randint(0, 2**31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+    return a, b
+
+
+def shingle_hashes(texts: Iterable[str]) -> "numpy.ndarray":
+    """32-bit hashes of the distinct word shingles of each text."""
+    import numpy as np
+
+    shingles = set()
+    for text in texts:
+        words = _WORD.findall((text or "").lower())
+        if len(words) < SHINGLE_WORDS:
+            if words:
+                shingles.add(" ".join(words))
+            continue
+        shingles.update(" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+class MinHash:
+    """A signature that can be fed text incrementally, e.g. one extracted page range at a time."""
+
+    def __init__(self):
+        import numpy as np
+
+        self.signature = np.full(NUM_PERM, MAX_HASH, dtype=np.uint64)
+
+    def update(self, texts: Iterable[str]) -> None:
+        import numpy as np
+
+        a, b = _permutations()
+        prime = np.uint64(PRIME)
+        hashes = shingle_hashes(texts)
+        for start in range(0, len(hashes), BLOCK_SIZE):
+            block = hashes[start:start + BLOCK_SIZE][None, :]
+            permuted = (a * block + b) % prime
+            np.minimum(self.signature, permuted.min(axis=1), out=self.signature)
+
+    def is_empty(self) -> bool:
+        return bool((self.signature == MAX_HASH).all())
+
+    def digest(self) -> bytes:
+        return self.signature.astype("<u4").tobytes()
+
+
+def from_digest(data: bytes) -> "numpy.ndarray":
+    import numpy as np
+
+    return np.frombuffer(data, dtype="<u4")
+
+
+def band_buckets(digest: bytes) -> List[Tuple[int, int]]:
+    """(band, bucket) pairs: a signed 64-bit hash of each band's rows."""
+    signature = from_digest(digest)
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        buckets.append((band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "big", signed=True)))
+    return buckets
+
+
+def page_chunks(pages_text: Iterable[str], chunk_size: int) -> Iterable[str]:
+    """The chunks processing stores for these pages; signatures are taken over these."""
+    for page_text in pages_text:
+        yield from utils.split_text_into_chunks(page_text, chunk_size)
+
+
+def _candidates_query(sha256: str, digest: bytes):
+    matches = or_(*(and_(BlobBand.band == band, BlobBand.bucket == bucket) for band, bucket in band_buckets(digest)))
+    candidates = select(BlobBand.sha256).where(matches, BlobBand.sha256 != sha256).distinct().limit(MAX_CANDIDATES)
+    return select(Blob.sha256, Blob.minhash).where(Blob.sha256.in_(candidates), Blob.minhash.isnot(None))
+
+
+def _score(digest: bytes, rows: Sequence, min_similarity: float) -> List[Tuple[str, float]]:
+    """Estimated Jaccard similarity (share of equal signature rows), best first."""
+    if not rows:
+        return []
+    import numpy as np
+
+    signature = from_digest(digest)
+    others = np.vstack([from_digest(row.minhash) for row in rows])
+    similarities = (others == signature).mean(axis=1)
+    scored = [(row.sha256, float(value)) for row, value in zip(rows, similarities) if value >= min_similarity]
+    return sorted(scored, key=lambda item: item[1], reverse=True)
+
+
+def index_blob(db: Session, sha256: str, minhash: MinHash) -> Optional[Tuple[str, float]]:
+    """
+    Stores the blob's signature and band buckets and flags it as a near duplicate of
+    the most similar indexed blob at or above NEAR_DUPLICATE_THRESHOLD, which it
+    returns. The caller commits.
+    """
+    db.execute(delete(BlobBand).where(BlobBand.sha256 == sha256))
+    if minhash.is_empty():
+        db.execute(update(Blob).where(Blob.sha256 == sha256).values(minhash=None, near_duplicate_of=None))
+        return None
+
+    digest = minhash.digest()
+    matches = _score(digest, db.execute(_candidates_query(sha256, digest)).all(), NEAR_DUPLICATE_THRESHOLD)
+    duplicate = matches[0] if matches else None
+    db.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(minhash=digest, near_duplicate_of=duplicate[0] if duplicate else None)
+    )
+    db.add_all(BlobBand(sha256=sha256, band=band, bucket=bucket) for band, bucket in band_buckets(digest))
+    return duplicate
+
+
+async def find_similar(db: AsyncSession, blob: Blob, min_similarity: float) -> List[Tuple[str, float]]:
+    """Other blobs similar to this one, best first, as (sha256, estimated similarity)."""
+    if blob.minhash is None:
+        return []
+    rows = (await db.execute(_candidates_query(blob.sha256, blob.minhash))).all()
+    return _score(blob.minhash, rows, min_similarity)
+
+
+def backfill(db: Session) -> int:
+    """Indexes ready blobs without a signature from their stored pages. Returns how many it indexed."""
+    shas = db.scalars(select(Blob.sha256).where(Blob.status == "ready", Blob.minhash.is_(None))).all()
+    for sha256 in shas:
+        minhash = MinHash()
+        for text, offsets in db.execute(
+            select(DocumentPage.text, DocumentPage.chunk_offsets).where(DocumentPage.sha256 == sha256)
+        ):
+            minhash.update(utils.chunks_from_offsets(text, offsets))
+        index_blob(db, sha256, minhash)
+        db.commit()
+    return len(shas)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python similarity.py backfill")
+    session = SessionLocal()
+    try:
+        indexed = backfill(session)
+        logger.info(f"Indexed {indexed} blob(s)")
+    finally:
+        session.close()
@@ -0,0 +1,205 @@
+import io
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local, s3, memory
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "documents")
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def get_storage_root() -> str:
+    return os.getenv("STORAGE_FOLDER", str(Path.cwd() / "storage"))
+
+
+def blob_key(sha256: str) -> str:
+    """Content-addressed key of a stored PDF: blobs/ab/cd/abcd....pdf"""
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}.pdf"
+
+
+def temp_upload_path() -> str:
+    tmp_dir = os.path.join(get_storage_root(), "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{uuid.uuid4()}.part")
+
+
+class BlobStat(NamedTuple):
+    size: int
+    last_modified: datetime
+
+
+class StorageBackend:
+    """Where blob bytes live. Uploads arrive as a local temp file; reads may be ranged."""
+
+    def put(self, tmp_path: str, sha256: str) -> None:
+        """Moves a finished temp file into storage under the blob's key."""
+        raise NotImplementedError
+
+    def delete(self, sha256: str) -> None:
+        raise NotImplementedError
+
+    def stat(self, sha256: str) -> Optional[BlobStat]:
+        raise NotImplementedError
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        """A filesystem path for the blob if this backend has one (enables sendfile)."""
+        return None
+
+    def iter_range(self, sha256: str, start: int, end: int) -> Iterator[bytes]:
+        """Yields bytes start..end inclusive."""
+        raise NotImplementedError
+
+    @contextmanager
+    def local_copy(self, sha256: str):
+        """Yields a filesystem path with the blob's content, downloading it if needed."""
+        path = self.local_path(sha256)
+        if path is not None:
+            yield path
+            return
+        stat = self.stat(sha256)
+        if stat is None:
+            raise FileNotFoundError(blob_key(sha256))
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            for chunk in self.iter_range(sha256, 0, stat.size - 1):
+                tmp.write(chunk)
+            tmp.flush()
+            yield tmp.name
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: Optional[str] = None):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root or get_storage_root(), *blob_key(sha256).split("/"))
+
+    def put(self, tmp_path: str, sha256: str) -> None:
+        # the rename is atomic and identical hashes mean identical content,
+        # so an existing blob is simply replaced
+        path = self.path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def delete(self, sha256: str) -> None:
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stat(self, sha256: str) -> Optional[BlobStat]:
+        try:
+            result = os.stat(self.path(sha256))
+        except FileNotFoundError:
+            return None
+        return BlobStat(result.st_size, datetime.fromtimestamp(result.st_mtime, tz=timezone.utc))
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        path = self.path(sha256)
+        return path if os.path.exists(path) else None
+
+    def iter_range(self, sha256: str, start: int, end: int) -> Iterator[bytes]:
+        with open(self.path(sha256), "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class ObjectStorage(StorageBackend):
+    """
+    Object-store backend over an S3-style client (put_object / get_object with Range /
+    head_object / delete_object), e.g. boto3, or InMemoryObjectClient locally.
+    """
+
+    def __init__(self, client, bucket: str = STORAGE_BUCKET):
+        self.client = client
+        self.bucket = bucket
+
+    def put(self, tmp_path: str, sha256: str) -> None:
+        with open(tmp_path, "rb") as file:
+            self.client.put_object(Bucket=self.bucket, Key=blob_key(sha256), Body=file)
+        os.remove(tmp_path)
+
+    def delete(self, sha256: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=blob_key(sha256))
+
+    def stat(self, sha256: str) -> Optional[BlobStat]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=blob_key(sha256))
+        except Exception:
+            return None
+        return BlobStat(head["ContentLength"], head["LastModified"])
+
+    def iter_range(self, sha256: str, start: int, end: int) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=blob_key(sha256), Range=f"bytes={start}-{end}")["Body"]
+        try:
+            while True:
+                chunk = body.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+
+class InMemoryObjectClient:
+    """Minimal in-process stand-in for an S3 client, for local runs and tests."""
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body) -> None:
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = (data, datetime.now(timezone.utc))
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        data, modified = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(data), "LastModified": modified}
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None) -> dict:
+        data, modified = self.objects[(Bucket, Key)]
+        if Range:
+            start, _, end = Range[len("bytes="):].partition("-")
+            data = data[int(start): int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "LastModified": modified}
+
+    def delete_object(self, Bucket: str, Key: str) -> None:
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+
+
+def build_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    if name == "memory":
+        return ObjectStorage(InMemoryObjectClient())
+    if name == "s3":
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3")
+        return ObjectStorage(boto3.client("s3", endpoint_url=os.getenv("STORAGE_ENDPOINT_URL") or None))
+    return LocalStorage()
+
+
+backend: StorageBackend = build_backend()
+
+
+def store_blob(tmp_path: str, sha256: str) -> None:
+    backend.put(tmp_path, sha256)
+
+
+def blob_exists(sha256: str) -> bool:
+    return backend.stat(sha256) is not None
+
+
+def delete_blob(sha256: str) -> None:
+    backend.delete(sha256)
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("uploads")
+
+READ_CHUNK_SIZE = 1024 * 1024
+# room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def get_max_file_size() -> int:
+    return int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+
+
+def get_max_batch_files() -> int:
+    return int(os.getenv("MAX_BATCH_FILES", "20"))
+
+
+# upload routes and the number of files each may carry
+UPLOAD_PATHS = {
+    "/documents": lambda: 1,
+    "/documents/batch": get_max_batch_files,
+}
+
+
+class BodyTooLarge(HTTPException):
+    """
+    Raised from receive() or while saving an upload; an HTTPException so request
+    parsing re-raises it, and both paths answer 413.
+    """
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="File too large")
+
+
+class UploadLimitMiddleware:
+    """
+    Rejects oversized upload bodies before they are parsed and spooled to disk:
+    up front from Content-Length, or as soon as a chunked body crosses the limit.
+    """
+
+    def __init__(self, app, paths: Dict[str, Callable[[], int]] = UPLOAD_PATHS):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        max_files = self.paths[scope["path"]]()
+        limit = max_files * (get_max_file_size() + MULTIPART_OVERHEAD)
+        too_large = JSONResponse(status_code=413, content={"detail": "File too large"})
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            logger.warning(f"Rejected upload with Content-Length {int(content_length)}")
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge:
+            logger.warning(f"Aborted upload after {received} bytes")
+            if not response_started:
+                await too_large(scope, receive, send)
+
+
+def _write_chunk(buffer, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def save_upload(file: UploadFile, tmp_path: str, max_size: int) -> Tuple[int, str]:
+    """
+    Streams the upload to tmp_path in one pass, enforcing max_size and checking the
+    PDF header as it goes. Hashing and writes run off the event loop.
+    Returns (size, sha256 hex digest); the caller moves the file into storage.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(b"%PDF-"):
+                raise HTTPException(status_code=400, detail="Only PDF files allowed")
+            size += len(chunk)
+            if size > max_size:
+                logger.warning(f"File too large: more than {max_size} bytes")
+                raise BodyTooLarge()
+            await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        await run_in_threadpool(buffer.close)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+    except BaseException:
+        buffer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size, digest.hexdigest()
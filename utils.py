@@ -1,35 +1,52 @@
-import logging
-import PyPDF2
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple
 
-logger = logging.getLogger("utils")
+# PyPDF2 is imported where a PDF is read: only the worker's extraction processes
+# need it, and web workers boot faster without it.
 
-def extract_text_from_pdf(file_path: str) -> List[str]:
+def extract_pdf_range_timed(
+    file_path: str, start: int = 0, stop: Optional[int] = None
+) -> Tuple[int, List[str], float, List[float]]:
     """
-    Returns a list of page texts. Empty string for pages with no extractable text.
+    Parses the PDF once and returns (page_count, page texts for the 0-based range start:stop,
+    parse seconds, extraction seconds per page). Empty string for pages with no extractable
+    text. Raises on unreadable files.
     """
-    try:
+    import PyPDF2
+
+    started = time.perf_counter()
+    with open(file_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+        parse_seconds = time.perf_counter() - started
+        stop = page_count if stop is None else min(stop, page_count)
         pages_text: List[str] = []
-        with open(file_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text = page.extract_text() or ""   # guard None
-                pages_text.append(text)
-        return pages_text
-    except Exception as e:
-        logger.error(f"PDF read error: {e}")
-        return []
+        page_seconds: List[float] = []
+        for index in range(start, stop):
+            page_started = time.perf_counter()
+            text = reader.pages[index].extract_text() or ""   # guard None
+            page_seconds.append(time.perf_counter() - page_started)
+            pages_text.append(text)
+        return page_count, pages_text, parse_seconds, page_seconds
 
-def get_page_count(file_path: str) -> int:
-    try:
-        with open(file_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            return len(reader.pages)
-    except Exception:
-        return 0
+def extract_pdf_range(file_path: str, start: int = 0, stop: Optional[int] = None) -> Tuple[int, List[str]]:
+    """
+    Parses the PDF once and returns (page_count, page texts for the 0-based range start:stop).
+    Empty string for pages with no extractable text. Raises on unreadable files.
+    """
+    return extract_pdf_range_timed(file_path, start, stop)[:2]
 
 def split_text_into_chunks(text: Optional[str], chunk_size: int = 800) -> List[str]:
     text = text or ""  # guard None
     if len(text) <= chunk_size:
         return [text]
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+def chunk_offsets(text: Optional[str], chunk_size: int = 800) -> List[int]:
+    """Start offset of each chunk split_text_into_chunks would produce."""
+    return list(range(0, len(text or ""), chunk_size)) or [0]
+
+def chunks_from_offsets(text: Optional[str], offsets: List[int]) -> List[str]:
+    text = text or ""
+    ends = list(offsets[1:]) + [len(text)]
+    return [text[start:end] for start, end in zip(offsets, ends)]
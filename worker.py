@@ -0,0 +1,132 @@
+"""
+Processing worker. Claims jobs from the processing_jobs table and extracts PDFs
+in a process pool, outside the web workers.
+
+    python worker.py
+"""
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import jobs
+import metrics
+import storage
+from database import engine, SessionLocal
+from processing import process_document_task
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s")
+metrics.install_log_filter()
+logger = logging.getLogger("worker")
+
+POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+RECOVER_SECONDS = float(os.getenv("WORKER_RECOVER_SECONDS", "60"))
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(os.cpu_count() or 1)))
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self, executor: ProcessPoolExecutor, processes: int = EXTRACT_PROCESSES):
+        self.executor = executor
+        self.processes = processes
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        self.last_recovery = 0.0
+
+    def stop(self, *_):
+        logger.info("Stopping after the current job")
+        self.stopping = True
+
+    def restart_executor(self):
+        """Replaces a broken process pool, which would otherwise reject every later job."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+
+    def recover(self):
+        db = SessionLocal()
+        try:
+            recovered = jobs.recover_stale_jobs(db)
+            if recovered:
+                logger.info(f"Recovered {recovered} stale job(s)")
+        finally:
+            db.close()
+        self.last_recovery = time.monotonic()
+
+    def run_once(self) -> bool:
+        """Processes one job. Returns False when the queue was empty."""
+        db = SessionLocal()
+        try:
+            job = jobs.claim_job(db, self.worker_id)
+            if job is None:
+                return False
+            job_id, sha256 = job.id, job.sha256
+        finally:
+            db.close()
+
+        def heartbeat():
+            lease_db = SessionLocal()
+            try:
+                if not jobs.renew_lease(lease_db, job_id, self.worker_id):
+                    raise LeaseLost(f"Lease lost for job {job_id}")
+            finally:
+                lease_db.close()
+
+        token = metrics.request_id_var.set(f"job-{job_id}")
+        db = SessionLocal()
+        try:
+            with storage.backend.local_copy(sha256) as file_path:
+                process_document_task(sha256, file_path, self.executor, heartbeat)
+            if not jobs.complete_job(db, job_id, self.worker_id):
+                logger.warning(f"Lease lost for job {job_id} before it completed")
+        except LeaseLost as e:
+            logger.warning(str(e))
+        except BrokenProcessPool as e:
+            logger.error(f"Extraction process pool broke while processing blob {sha256}; restarting it")
+            self.restart_executor()
+            jobs.release_crashed_job(db, job_id, self.worker_id, str(e) or e.__class__.__name__)
+        except Exception as e:
+            logger.error(f"Error processing blob {sha256}: {e}")
+            jobs.fail_job(db, job_id, str(e) or e.__class__.__name__, self.worker_id)
+        finally:
+            db.close()
+            metrics.request_id_var.reset(token)
+        return True
+
+    def run(self):
+        logger.info(f"Worker {self.worker_id} started with {EXTRACT_PROCESSES} extraction process(es)")
+        while not self.stopping:
+            if time.monotonic() - self.last_recovery >= RECOVER_SECONDS:
+                self.recover()
+            try:
+                if not self.run_once():
+                    time.sleep(POLL_SECONDS)
+            except Exception as e:
+                logger.error(f"Worker loop error: {e}")
+                time.sleep(POLL_SECONDS)
+
+
+def main():
+    metrics.instrument_engine(engine, "sync")
+    if METRICS_PORT:
+        from prometheus_client import start_http_server
+
+        start_http_server(METRICS_PORT)
+        logger.info(f"Serving worker metrics on port {METRICS_PORT}")
+    worker = Worker(ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES))
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    try:
+        worker.run()
+    finally:
+        worker.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()